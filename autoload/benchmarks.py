@@ -0,0 +1,312 @@
+"""
+Benchmarks of the Python side of Mundo, driven through a fake vim module.
+
+Synthetic undo trees of a few shapes and sizes are generated, and the main
+operations are timed against them. Results are printed as JSON, one object
+per operation, with the time taken, the peak memory allocated (on Python 3)
+and the number of undo jumps made in the target buffer.
+
+    python benchmarks.py
+    python benchmarks.py --shapes linear --states 1000,10000 --lines 500
+
+Peak memory is measured with tracemalloc, which slows everything down
+several times over: pass --no-memory for times closer to real use.
+"""
+import argparse
+import gc
+import json
+import random
+import re
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from mundo import diff, graphlog, util
+from mundo.node import Nodes
+
+SHAPES = ('linear', 'bushy', 'deep_alt')
+
+# States whose full contents the fake buffer keeps; the others are rebuilt
+# from their nearest such ancestor.
+CHECKPOINT_DEPTH = 64
+
+def make_parents(shape, states, seed=0):
+    """
+    Return the parent of each state 1..'states' (index 0 is the root):
+
+      linear   - a single chain of changes.
+      bushy    - every change is made after undoing a few recent ones, so
+                 there are branches everywhere.
+      deep_alt - every other change starts a branch off the previous branch,
+                 so undotree() nests 'alt' entries ever more deeply.
+    """
+    rand = random.Random(seed)
+    parents = [None]
+    for n in range(1, states + 1):
+        if shape == 'linear':
+            parent = n - 1
+        elif shape == 'bushy':
+            parent = rand.randint(max(n - 20, 0), n - 1)
+        elif shape == 'deep_alt':
+            parent = n - 1 if n % 2 or n < 3 else n - 3
+        else:
+            raise ValueError('unknown shape: %s' % shape)
+        parents.append(parent)
+    return parents
+
+class FakeBuffer(object):
+    def __init__(self, vim):
+        self.vim = vim
+
+    def __len__(self):
+        return len(self.vim.contents(self.vim.seq_cur))
+
+    def __getitem__(self, index):
+        return self.vim.contents(self.vim.seq_cur)[index]
+
+class FakeVim(object):
+    """
+    Just enough of the vim module for Nodes and graphlog: the target buffer
+    (number 1) has the undo tree described by 'parents', and each change
+    edits or adds one line of a file that starts with 'lines' lines.
+    """
+    def __init__(self, parents, lines, seed=0):
+        rand = random.Random(seed)
+        self.parents = parents
+        self.depth = [0]
+        self.edits = [None]
+        self.checkpoints = {0: ['line %d' % i for i in range(lines)]}
+        self.sizes = [lines]
+        for n in range(1, len(parents)):
+            p = parents[n]
+            size = self.sizes[p]
+            if rand.random() < 0.2:
+                edit = (rand.randint(0, size), True, 'line added in %d' % n)
+                size += 1
+            else:
+                edit = (rand.randint(0, size - 1), False, 'line changed in %d' % n)
+            self.depth.append(self.depth[p] + 1)
+            self.edits.append(edit)
+            self.sizes.append(size)
+            if self.depth[n] % CHECKPOINT_DEPTH == 0:
+                self.checkpoints[n] = self.contents(n)
+
+        self.seq_cur = len(parents) - 1
+        self.changedtick = 1
+        self.undo_jumps = 0
+        self.evals = 0
+        self.commands = 0
+        self.vars = {}
+        self.buffers = {1: FakeBuffer(self)}
+        self.pattern = ''
+        self.settings = dict((name, '0') for name, expr, kind in util.SETTINGS)
+        self.settings.update({
+            'target_n': '1',
+            'target_f': 'benchmark.txt',
+            'target_loaded': '1',
+            'target_winnr': '1',
+            'target_width': '80',
+            'first_visible_line': '1',
+            'last_visible_line': '60',
+            'map_move_older': 'j',
+            'map_move_newer': 'k',
+            'cache_max_bytes': str(32 * 1024 * 1024),
+            'diff_cache_max_bytes': str(8 * 1024 * 1024),
+            'cache_dir': '',
+            'win_execute': '1',
+        })
+
+    def contents(self, n):
+        """ Return the lines of state 'n'. """
+        edits = []
+        while n not in self.checkpoints:
+            edits.append(self.edits[n])
+            n = self.parents[n]
+        lines = list(self.checkpoints[n])
+        for i, insert, line in reversed(edits):
+            if insert:
+                lines.insert(i, line)
+            else:
+                lines[i] = line
+        return lines
+
+    def undotree(self):
+        """ Build undotree() of the target buffer, as Vim nests it. """
+        children = [[] for _ in self.parents]
+        for n in range(1, len(self.parents)):
+            children[self.parents[n]].append(n)
+        # Each entry lists the branch of its next older sibling under 'alt'.
+        older = {}
+        for kids in children:
+            for a, b in zip(kids, kids[1:]):
+                older[b] = a
+
+        entries = []
+        work = [(entries, children[0] and children[0][-1])]
+        while work:
+            chain, n = work.pop()
+            while n:
+                entry = {'seq': n, 'time': 1000000000 + n}
+                if n in older:
+                    entry['alt'] = []
+                    work.append((entry['alt'], older[n]))
+                chain.append(entry)
+                n = children[n] and children[n][-1]
+        return {'seq_last': len(self.parents) - 1, 'save_last': 0,
+                'seq_cur': self.seq_cur, 'entries': entries}
+
+    def add_state(self, line):
+        """ Make a new change after the current state. """
+        n = len(self.parents)
+        self.parents.append(self.seq_cur)
+        self.depth.append(self.depth[self.seq_cur] + 1)
+        self.edits.append((0, True, line))
+        self.sizes.append(self.sizes[self.seq_cur] + 1)
+        self.seq_cur = n
+        self.changedtick += 1
+
+    def eval(self, expr):
+        self.evals += 1
+        if expr == util.SETTINGS_EXPR:
+            return self.settings
+        if expr == 'getbufvar(1, "changedtick")':
+            return str(self.changedtick)
+        if expr == 'g:mundo_undotree':
+            return self.undotree()
+        if expr.startswith('filter(range(len(g:mundo_search_lines))'):
+            pattern = re.compile(self.pattern)
+            lines = self.vars['mundo_search_lines']
+            return [str(i) for i, line in enumerate(lines) if pattern.search(line)]
+        raise ValueError('unexpected eval: %s' % expr)
+
+    def command(self, command):
+        self.commands += 1
+        match = re.match(r"call win_execute\(win_getid\(bufwinnr\(1\)\), '(.*)'\)$", command)
+        if match:
+            command = match.group(1).replace("''", "'")
+        match = re.match(r'silent undo (\d+)$', command)
+        if match:
+            self.seq_cur = int(match.group(1))
+        elif command.startswith("execute 'silent earlier "):
+            self.seq_cur = 0
+        else:
+            return
+        self.undo_jumps += 1
+        self.changedtick += 1
+
+def measure(fake, operation, fn, memory=True):
+    """ Run 'fn' and return its result along with what it cost. """
+    gc.collect()
+    jumps = fake.undo_jumps
+    evals = fake.evals
+    trace = memory and tracemalloc
+    if trace:
+        tracemalloc.start()
+    start = time.time()
+    result = fn()
+    seconds = time.time() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, {
+        'operation': operation,
+        'seconds': round(seconds, 6),
+        'peak_bytes': peak,
+        'undo_jumps': fake.undo_jumps - jumps,
+        'vim_evals': fake.evals - evals,
+    }
+
+def run(shape, states, lines, search_max, samples, seed=0, memory=True):
+    """ Benchmark every operation on one synthetic tree. """
+    fake = FakeVim(make_parents(shape, states, seed), lines, seed)
+    util.vim = lambda: fake
+    util.snapshot()
+    graphlog.layout.clear()
+    nodes = Nodes()
+    results = []
+
+    def record(operation, fn):
+        result, stats = measure(fake, operation, fn, memory)
+        stats.update({'shape': shape, 'states': states, 'lines': lines})
+        results.append(stats)
+        return result
+
+    record('make_nodes', nodes.make_nodes)
+    fake.add_state('line added after loading')
+    util.snapshot()
+    record('make_nodes_incremental', nodes.make_nodes)
+
+    record('generate', lambda: graphlog.generate(False, 3, 1, 60, False, nodes))
+    record('generate_inline', lambda: graphlog.generate(False, 3, 1, 60, True, nodes))
+    fake.add_state('another line added after loading')
+    util.snapshot()
+    record('generate_after_change', lambda: graphlog.generate(False, 3, 1, 60, False, nodes))
+    folds = graphlog.Folds()
+    folds.min_run = 2
+    record('generate_collapsed',
+           lambda: graphlog.generate(False, 3, 1, 60, False, nodes, None, folds))
+    # Opening the graph afresh, with a window of 60 lines and a page of 200.
+    graphlog.layout.clear()
+    record('generate_windowed',
+           lambda: graphlog.generate(False, 3, 1, 60, False, nodes, None, None, (260, None)))
+
+    node_list, nmap = nodes.make_nodes()
+    rand = random.Random(seed)
+    sample = [node for node in rand.sample(node_list, min(samples, len(node_list)))
+              if node.parent]
+
+    def preview_diffs():
+        for node in sample:
+            nodes.preview_diff(node.parent, node)
+        nodes.restore_current()
+    record('preview_diff', preview_diffs)
+
+    pairs = [('\n'.join(fake.contents(node.parent.n)), '\n'.join(fake.contents(node.n)))
+             for node in sample]
+    def one_line_diffs():
+        for before, after in pairs:
+            diff.one_line_diff_str(before, after, 80)
+    record('one_line_diff_str', one_line_diffs)
+
+    if states <= search_max:
+        fake.pattern = 'changed in 1'
+        record('search', lambda: nodes.search(fake.pattern))
+        fake.pattern = 'added in'
+        record('search_again', lambda: nodes.search(fake.pattern))
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shapes', default=','.join(SHAPES),
+                        help='comma separated tree shapes (default: %(default)s)')
+    parser.add_argument('--states', default='1000,10000,100000',
+                        help='comma separated tree sizes (default: %(default)s)')
+    parser.add_argument('--lines', type=int, default=200,
+                        help='lines in the original file (default: %(default)s)')
+    parser.add_argument('--samples', type=int, default=50,
+                        help='states to diff against their parent (default: %(default)s)')
+    parser.add_argument('--search-max', type=int, default=1000,
+                        help='largest tree to search, as searching visits every '
+                             'state (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="don't measure peak memory")
+    args = parser.parse_args(argv)
+
+    results = []
+    for shape in args.shapes.split(','):
+        for states in [int(s) for s in args.states.split(',')]:
+            results.extend(run(shape, states, args.lines, args.search_max,
+                               args.samples, args.seed, args.memory))
+    json.dump({'python': sys.version.split()[0], 'results': results},
+              sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import nose
+from nose.tools import *
+import sys
+from mundo.cache import LRUCache, measure
+
+def test_lru_eviction():
+  cache = LRUCache(30, sizeof=len)
+  cache['a'] = 'x' * 10
+  cache['b'] = 'y' * 10
+  cache['c'] = 'z' * 10
+  eq_(cache.get('a'), 'x' * 10)
+  cache['d'] = 'w' * 10
+  ok_('b' not in cache)
+  ok_('a' in cache)
+  eq_(cache.stats()['evictions'], 1)
+  eq_(cache.stats()['bytes'], 30)
+
+def test_lru_counters():
+  cache = LRUCache(30, sizeof=len)
+  cache['a'] = 'x' * 40
+  eq_(cache.get('a'), None)
+  cache['b'] = 'y'
+  eq_(cache.get('b'), 'y')
+  stats = cache.stats()
+  eq_((stats['hits'], stats['misses'], stats['evictions']), (1, 1, 1))
+
+def test_measure_shared():
+  line = 'shared line' * 10
+  first, second = [line, 'a'], [line]
+  seen = set()
+  size = measure(first, seen)
+  eq_(size, sys.getsizeof(first) + sys.getsizeof(line) + sys.getsizeof('a'))
+  eq_(measure(second, seen), sys.getsizeof(second))
+  eq_(measure({'k': first}, seen), sys.getsizeof({'k': first}) + sys.getsizeof('k'))
+
@@ -0,0 +1,88 @@
+import difflib
+import json
+import time
+import nose
+from nose.tools import *
+from mock import patch
+from mundo import worker
+from mundo.diffqueue import DiffQueue, PENDING, Timeout, WorkerQueue, WORKER_MIN_LINES
+
+def test_diff_queue():
+  queue = DiffQueue()
+  queue.submit('a', 'm\nbagman', 'm\nbadger', 15)
+  queue.submit('b', '', '1234567890abcdefghij', 15)
+  results = {}
+  for i in range(100):
+    results.update(queue.results())
+    if len(results) == 2:
+      break
+    time.sleep(0.01)
+  eq_(results, {'a': 'ba+d+g-an-+er+', 'b': '+1234567890abc+'})
+  ok_(not queue.busy())
+
+class FakeWorker(object):
+  """ Runs the worker's requests as they are sent, unless asked to hang. """
+  def __init__(self):
+    self.responses = []
+    self.hang = False
+    self.starts = 0
+
+  def start(self, command):
+    self.starts += 1
+    self.responses = []
+    return True
+
+  def send(self, line):
+    if not self.hang:
+      self.responses.append(json.dumps(worker.handle(json.loads(line))))
+    return True
+
+  def read(self, timeout):
+    return self.responses and self.responses.pop(0) or ''
+
+def _worker_queue(fake, timeout=1000):
+  with patch.multiple('mundo.util', _worker_start=fake.start,
+                      _worker_send=fake.send, _worker_read=fake.read,
+                      _worker_stop=lambda: None):
+    return WorkerQueue('python', timeout)
+
+def test_worker_queue():
+  fake = FakeWorker()
+  queue = _worker_queue(fake)
+  with patch.multiple('mundo.util', _worker_send=fake.send, _worker_read=fake.read):
+    queue.submit('a', 'm\nbagman', 'm\nbadger', 15)
+    queue.submit('b', '', '1234567890abcdefghij', 15)
+    eq_(queue.results(), {'a': 'ba+d+g-an-+er+', 'b': '+1234567890abc+'})
+    ok_(not queue.busy())
+
+    a = list(range(WORKER_MIN_LINES))
+    b = a[:10] + [-1] + a[11:]
+    eq_(queue.opcodes('p', a, b, 3), PENDING)
+    ok_(queue.answered('p'))
+    eq_(queue.opcodes('p', a, b, 3),
+        [[list(op) for op in group] for group in
+         difflib.SequenceMatcher(None, a, b).get_grouped_opcodes(3)])
+    eq_(queue.opcodes('q', [1], [2], 3), None)
+
+def test_worker_queue_timeout():
+  fake = FakeWorker()
+  queue = _worker_queue(fake, timeout=0)
+  with patch.multiple('mundo.util', _worker_start=fake.start, _worker_send=fake.send,
+                      _worker_read=fake.read, _worker_stop=lambda: None):
+    fake.hang = True
+    queue.submit('a', 'before', 'after', 15)
+    ok_(queue.busy())
+    time.sleep(0.01)
+    eq_(queue.results(), {})
+    eq_(fake.starts, 2)
+    ok_(not queue.busy())
+    # Cancelled summaries aren't asked for again.
+    queue.submit('a', 'before', 'after', 15)
+    ok_(not queue.busy())
+    # Previews are cancelled the same way, without waiting for the worker.
+    eq_(queue.opcodes('p', [0] * WORKER_MIN_LINES, [], 3), PENDING)
+    ok_(queue.busy())
+    time.sleep(0.01)
+    ok_(queue.answered('p'))
+    eq_(fake.starts, 3)
+    assert_raises(Timeout, queue.opcodes, 'p', [0] * WORKER_MIN_LINES, [], 3)
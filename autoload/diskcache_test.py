@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from nose.tools import *
+from mundo import diskcache
+
+def _open(directory, seq_last=5, oldest=[1, 100]):
+  return diskcache.open_cache(directory, '/tmp/file.txt', '/tmp/.file.txt.un~',
+                              seq_last, oldest)
+
+def test_reopen():
+  directory = tempfile.mkdtemp()
+  try:
+    cache = _open(directory)
+    cache.put('1-2-pd-True 100 200', 2, ['--- 1\n', '+two'])
+    cache.put('2-3-pd-False 200 300 80', 3, '+three+')
+    eq_(cache.get('2-3-pd-False 200 300 80'), '+three+')
+    cache.close()
+
+    cache = _open(directory)
+    eq_(cache.get('1-2-pd-True 100 200'), ['--- 1\n', '+two'])
+    eq_(cache.get('2-3-pd-False 200 300 80'), '+three+')
+    eq_(cache.get('3-4-pd-True 300 400'), None)
+    cache.close()
+  finally:
+    shutil.rmtree(directory)
+
+def test_stale():
+  directory = tempfile.mkdtemp()
+  try:
+    cache = _open(directory)
+    cache.put('2-3-pd-False 200 300 80', 3, '+three+')
+    cache.close()
+
+    # Fewer states than were cached: this is another history.
+    cache = _open(directory, seq_last=2)
+    ok_('2-3-pd-False 200 300 80' not in cache)
+    cache.put('1-2-pd-False 100 200 80', 2, '+two+')
+    cache.close()
+
+    # The oldest state changed.
+    cache = _open(directory, oldest=[2, 200])
+    ok_('1-2-pd-False 100 200 80' not in cache)
+    cache.close()
+  finally:
+    shutil.rmtree(directory)
+
+def test_interrupted_write():
+  directory = tempfile.mkdtemp()
+  try:
+    cache = _open(directory)
+    cache.put('1-2-pd-False 100 200 80', 2, '+two+')
+    cache.close()
+    with open(cache.filename, 'ab') as f:
+      f.write(b'2-3-pd-False 200 300 80\t3\t"+th')
+
+    cache = _open(directory)
+    eq_(cache.get('1-2-pd-False 100 200 80'), '+two+')
+    cache.put('2-3-pd-False 200 300 80', 3, '+three+')
+    eq_(cache.get('2-3-pd-False 200 300 80'), '+three+')
+    cache.close()
+  finally:
+    shutil.rmtree(directory)
@@ -2,7 +2,7 @@ import nose
 from nose.tools import *
 from mock import patch
 import mundo.graphlog as graphlog
-from mundo.node import Nodes
+from mundo.node import Node, Nodes
 
 @patch('mundo.util.vim')
 def test_generate(mock_vim):
@@ -14,3 +14,110 @@ def test_generate(mock_vim):
     False,
     Nodes() 
   ), [['o ', '[0] Original   ']])
+
+def test_layout_reuses_rows():
+  root = Node(0, None, False, False)
+  one = Node(1, root, 1, False)
+  two = Node(2, one, 2, False)
+  layout = graphlog.Layout()
+  rows = layout.update([root, one, two], True)
+  eq_([graph for node, column, graph in rows], [['o ', '| '], ['o ', '| '], ['o ']])
+
+  # a linear change only lays out its own row...
+  three = Node(3, two, 3, False)
+  new_rows = layout.update([root, one, two, three], True)
+  ok_(new_rows[1] is rows[0])
+
+  # ...while a branch lays everything out again.
+  four = Node(4, one, 4, False)
+  new_rows = layout.update([root, one, two, three, four], True)
+  eq_([column for node, column, graph in new_rows], [0, 1, 1, 0, 0])
+
+def _tree(parents):
+  nodes = [Node(0, None, False, False)]
+  for n, p in enumerate(parents, 1):
+    node = Node(n, nodes[p], 1000 + 60 * n, False)
+    nodes[p].children.append(node)
+    nodes.append(node)
+  return nodes
+
+def test_folds():
+  # 0 - 1 - 2 - 3 - 4 - 5
+  #          \
+  #           6
+  nodes = _tree([0, 1, 2, 3, 4, 2])
+  folds = graphlog.Folds()
+  folds.min_run = 2
+  rows, parents = folds.collapse(nodes, 5)
+  chain = rows[3]
+  eq_([row.n for row in rows], [0, 1, 2, 4, 5, 6])
+  eq_([member.n for member in chain.members], [4, 3])
+  eq_(chain.summary(), '[3..4] 2 changes, 60 sec')
+  eq_(parents, {nodes[5]: chain})
+  eq_(folds.shown(3), 4)
+
+  layout = graphlog.Layout()
+  eq_([(node.n, column) for node, column, graph in layout.update(rows, False, parents)],
+      [(6, 0), (5, 1), (4, 1), (2, 0), (1, 0), (0, 0)])
+
+  # The current state is never folded, nor runs shorter than min_run.
+  eq_(len(folds.collapse(nodes, 4)[0]), 7)
+  folds.collapse(nodes, 5)
+  ok_(folds.expand(3))
+  eq_(len(folds.collapse(nodes, 5)[0]), 7)
+  ok_(not folds.expand(3))
+  ok_(folds.fold(4))
+  eq_(len(folds.collapse(nodes, 5)[0]), 6)
+
+def test_duration():
+  eq_(graphlog.duration(30), '30 sec')
+  eq_(graphlog.duration(2 * 3600 + 5), '2 hrs')
+
+def test_layout_count():
+  nodes = _tree([0, 1, 1, 3, 2, 5, 4, 6])
+  def rows(layout, nodes, count=None):
+    return [(node.n, column, graph) for node, column, graph in
+            layout.update(nodes, False, None, count)]
+  full = rows(graphlog.Layout(), nodes)
+
+  layout = graphlog.Layout()
+  eq_(rows(layout, nodes, 2), full[:2])
+  eq_(rows(layout, nodes, 5), full[:5])
+  eq_(rows(layout, nodes, 50), full)
+
+  # Rows laid out after a new state carry on from the checkpoint.
+  layout = graphlog.Layout()
+  rows(layout, nodes, 3)
+  new = Node(9, nodes[8], 1, False)
+  nodes[8].children.append(new)
+  eq_(rows(layout, nodes + [new]), rows(graphlog.Layout(), nodes + [new]))
+
+@patch('mundo.util.vim')
+def test_generate_window(mock_vim):
+  nodes = _tree([0, 1, 2, 3, 4])
+  data = Nodes()
+  data.make_nodes = lambda: (nodes, dict((node.n, node) for node in nodes))
+  data.current = lambda: 3
+  data.preview_diff = lambda *args: ''
+  graphlog.layout.clear()
+  row_nodes = []
+  graphlog.generate(False, 0, 0, 0, False, data, row_nodes, None, (1, None))
+  eq_([node.n for node in row_nodes], [5, 4, 3])
+  row_nodes = []
+  graphlog.generate(False, 0, 0, 0, False, data, row_nodes, None, (1, 1))
+  eq_([node.n for node in row_nodes], [5, 4, 3, 2, 1])
+
+def test_columns():
+  columns = graphlog.Columns()
+  for node in 'abc':
+    columns.append(node)
+  columns.replace(1, ['d', 'e'])
+  eq_(columns.nodes, ['a', 'd', 'e', 'c'])
+  eq_(columns.index, {'a': 0, 'd': 1, 'e': 2, 'c': 3})
+  columns.replace(0, [])
+  eq_(columns.nodes, ['d', 'e', 'c'])
+  eq_(columns.index, {'d': 0, 'e': 1, 'c': 2})
+  columns.replace(2, ['f'])
+  eq_(columns.index['f'], 2)
+  ok_('c' not in columns)
+  eq_(len(columns), 3)
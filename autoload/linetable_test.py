@@ -0,0 +1,21 @@
+import difflib
+from nose.tools import *
+from mundo.linetable import LineTable
+
+def test_intern():
+  table = LineTable()
+  eq_(list(table.intern(['a', 'b', 'a'])), [0, 1, 0])
+  eq_(list(table.intern(['b', 'c'])), [1, 2])
+  eq_(len(table), 3)
+  eq_(table.lines(table.intern(['c', 'a'])), ['c', 'a'])
+
+def test_unified_diff():
+  table = LineTable()
+  before = ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine']
+  after = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'eight', 'nine', 'ten']
+  for args in [(), ('1', '2', 'then', 'now')]:
+    eq_(list(table.unified_diff(table.intern(before), table.intern(after), *args)),
+        list(difflib.unified_diff(before, after, *args)))
+  eq_(list(table.unified_diff(table.intern([]), table.intern(['a']))),
+      list(difflib.unified_diff([], ['a'])))
+  eq_(list(table.unified_diff(table.intern(before), table.intern(before))), [])
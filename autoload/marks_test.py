@@ -0,0 +1,39 @@
+import nose
+from nose.tools import *
+from mundo.marks import Marks
+
+def _marks():
+  # Verbose graph: a node every other row, nodes 3 and 1 saved.
+  marks = Marks()
+  for row, n in enumerate([5, 4, 3, 2, 1, 0]):
+    marks.add(2 + 2 * row, row % 2, n, n in (3, 1))
+  return marks
+
+def test_lookups():
+  marks = _marks()
+  eq_(len(marks), 6)
+  eq_(marks[3], (6, 0))
+  eq_(marks.at(6), 3)
+  eq_(marks.at(7), None)
+  ok_(0 in marks)
+  ok_(6 not in marks)
+
+def test_move():
+  marks = _marks()
+  eq_(marks.move(4, 1), 2)
+  eq_(marks.move(4, 500), 5)
+  eq_(marks.move(4, -500), 0)
+  # From between two nodes.
+  eq_(marks.move(5, 1), 2)
+  eq_(marks.move(5, -1), 1)
+  # From the header.
+  eq_(marks.move(0, 1), 0)
+
+def test_move_saved():
+  marks = _marks()
+  eq_(marks.move_saved(2, 1), 2)
+  eq_(marks.move_saved(2, 2), 4)
+  eq_(marks.move_saved(2, 3), 5)
+  eq_(marks.move_saved(10, -1), 2)
+  eq_(marks.move_saved(6, -1), 0)
+  eq_(marks.move_saved(7, -1), 2)
@@ -9,15 +9,20 @@
 #
 # ============================================================================
 
+import os
 import re
-import sys
-import tempfile
-import vim
 
-from mundo.node import Nodes
+from mundo.diffqueue import DiffQueue, WorkerQueue
+from mundo.diskcache import _bytes
+from mundo.marks import Marks
+from mundo.node import Nodes, path_between
+from mundo.profiler import profiler
 import mundo.util as util
 import mundo.graphlog as graphlog
 
+# Calls into Vim go through util, so the profiler can time them.
+vim = util.vim()
+
 # Python Vim utility functions -----------------------------------------------------#{{{
 
 MISSING_BUFFER = "Cannot find Mundo's target buffer (%s)"
@@ -33,17 +38,21 @@ def _check_sanity():
     global nodesData
     if not nodesData:
         nodesData = Nodes()
-    b = int(vim.eval('g:mundo_target_n'))
+    settings = util.snapshot()
+    b = settings.target_n
 
-    if not vim.eval('bufloaded(%d)' % int(b)):
+    if not settings.target_loaded:
         vim.command('echo "%s"' % (MISSING_BUFFER % b))
         return False
 
-    w = int(vim.eval('bufwinnr(%d)' % int(b)))
+    w = settings.target_winnr
     if w == -1:
         vim.command('echo "%s"' % (MISSING_WINDOW % (w, b)))
         return False
 
+    nodesData.set_cache_budget(settings.cache_max_bytes,
+                               settings.diff_cache_max_bytes)
+
     return True
 
 INLINE_HELP = '''\
@@ -54,6 +63,7 @@ INLINE_HELP = '''\
 " /    - Find changes that match string.
 " n/N  - Next/Prev undo that matches search.
 " P    - Play current state to selected undo.
+" zo/zc - Expand/fold a run of changes.
 " d    - Vert diff of undo with current state.
 " p    - Diff of selected undo and current state.
 " r    - Diff of selected undo and prior undo.
@@ -66,52 +76,103 @@ INLINE_HELP = '''\
 
 nodesData = Nodes()
 
-# from profilehooks import profile
-# @profile(immediate=True)
-def MundoRenderGraph(force=False):
+# Summarize inline diffs in the background when a timer can pick them up: in
+# the worker process if there is one, or else on a thread.
+if int(vim.eval("has('timers')")):
+    if vim.eval('g:mundo_worker_python'):
+        nodesData.diff_queue = WorkerQueue(vim.eval('g:mundo_worker_python'),
+                                           int(vim.eval('g:mundo_worker_timeout')))
+    else:
+        nodesData.diff_queue = DiffQueue()
+
+# The lines last written to the __Mundo__ buffer, and that buffer's number.
+graph_lines = None
+graph_buffer = None
+
+# Where the marker of each node is in those lines.
+graph_marks = Marks()
+
+# The runs of states folded in the collapsed view (see g:mundo_collapse).
+folds = graphlog.Folds()
+
+# Calls of MundoRenderGraph that rendered the graph, and that found it was
+# up to date.
+render_stats = {'rendered': 0, 'skipped': 0}
+
+# The function rendering the preview again once the worker computed its diff.
+preview_render = None
+
+@profiler.operation('render')
+def MundoRenderGraph(force=False, reach=None):
+    """
+    Render the graph, if anything changed since it last was. When it is
+    windowed (see g:mundo_graph_page), make sure it reaches down to the row
+    of node 'reach'.
+    """
+    global graph_lines, graph_buffer
     if not _check_sanity():
         return
 
-    first_visible_line = int(vim.eval("line('w0')"))
-    last_visible_line = int(vim.eval("line('w$')"))
+    settings = util.settings()
+    first_visible_line = settings.first_visible_line
+    last_visible_line = settings.last_visible_line
 
-    verbose = vim.eval('g:mundo_verbose_graph') == "1"
-    target = (int(vim.eval('g:mundo_target_n')),
-                vim.eval('g:mundo_map_move_older'),
-                vim.eval('g:mundo_map_move_newer'))
+    verbose = settings.verbose_graph == 1
+    target = (settings.target_n,
+                settings.map_move_older,
+                settings.map_move_newer)
 
-    if int(vim.eval('g:mundo_help')):
+    if settings.help:
         header = (INLINE_HELP % target).splitlines()
     else:
         header = [(INLINE_HELP % target).splitlines()[0], '\n']
 
-    show_inline_undo = int(vim.eval("g:mundo_inline_undo")) == 1
-    mundo_last_visible_line = int(vim.eval("g:mundo_last_visible_line"))
-    mundo_first_visible_line = int(vim.eval("g:mundo_first_visible_line"))
-
-    if not force and not nodesData.is_outdated() and (
+    show_inline_undo = settings.inline_undo == 1
+    mundo_last_visible_line = settings.mundo_last_visible_line
+    mundo_first_visible_line = settings.mundo_first_visible_line
+
+    # A windowed graph is only generated a page past the bottom of its window,
+    # and further as it scrolls down.
+    window = None
+    more = False
+    if settings.graph_page > 0 and settings.graph_bottom >= 0:
+        window = (settings.graph_bottom + settings.graph_page - len(header), reach)
+        more = graph_lines is not None and 0 not in graph_marks and (
+            len(graph_lines) < settings.graph_bottom + settings.graph_page // 2 or
+            (reach is not None and folds.shown(reach) not in graph_marks))
+
+    if not force and not more and not nodesData.is_outdated() and (
                 not show_inline_undo or 
                 (
                     mundo_first_visible_line == first_visible_line and
                     mundo_last_visible_line == last_visible_line
                 )
             ):
+        render_stats['skipped'] += 1
         return
+    render_stats['rendered'] += 1
 
+    if nodesData.diff_queue:
+        nodesData.diff_queue.next_round()
+    row_nodes = []
+    folds.min_run = settings.collapse
     result = graphlog.generate(
             verbose,
             len(header)+1,
             first_visible_line,
             last_visible_line,
             show_inline_undo,
-            nodesData
+            nodesData,
+            row_nodes,
+            folds,
+            window
     )
     vim.command("let g:mundo_last_visible_line=%s"%last_visible_line)
     vim.command("let g:mundo_first_visible_line=%s"%first_visible_line)
 
     output = []
     # right align the dag and flip over the y axis:
-    flip_dag = int(vim.eval("g:mundo_mirror_graph")) == 1
+    flip_dag = settings.mirror_graph == 1
     dag_width = 1
     for line in result:
         if len(line[0]) > dag_width:
@@ -124,23 +185,60 @@ def MundoRenderGraph(force=False):
             output.append("%-*s %s"% (dag_width,line[0],line[1]))
 
     vim.command('call s:MundoOpenGraph()')
-    vim.command('setlocal modifiable')
     lines = (header + output)
     lines = [line.rstrip('\n') for line in lines]
-    vim.current.buffer[:] = lines
-    vim.command('setlocal nomodifiable')
-
-    i = 1
-    for line in output:
-        try:
-            line.split('[')[0].index('@')
-            i += 1
-            break
-        except ValueError:
-            pass
-        i += 1
-    vim.command('%d' % (i+len(header)-1))
+    buffer = vim.current.buffer
+    if buffer.number != graph_buffer:
+        graph_lines = None
+    if lines != graph_lines:
+        vim.command('setlocal modifiable')
+        util._update_buffer(buffer, graph_lines, lines)
+        vim.command('setlocal nomodifiable')
+    graph_lines = lines
+    graph_buffer = buffer.number
+
+    current = nodesData.current()
+    i = len(output)
+    graph_marks.clear()
+    for row, node in enumerate(row_nodes):
+        if node is None:
+            continue
+        if node.n == current:
+            i = row
+        dag = output[row][:dag_width]
+        column = min(dag.find(char) for char in '@ow:' if char in dag)
+        graph_marks.add(len(header) + row, column, node.n, node.saved)
+    vim.command('%d' % (i+len(header)+1))
+
+    if nodesData.diff_queue and nodesData.diff_queue.busy():
+        vim.command('call s:MundoStartInlineDiffTimer()')
+
+@profiler.operation('inline diffs')
+def MundoPollInlineDiffs():
+    """
+    Show the inline diffs summarized in the background since the last poll,
+    and the preview once the worker is done with its diff.
+    """
+    global preview_render
+    if nodesData.collect_inline_diffs():
+        MundoRenderGraph(True)
+    if preview_render and nodesData.preview_ready():
+        render, preview_render = preview_render, None
+        render()
+    if nodesData.diff_queue.busy():
+        vim.command('call s:MundoStartInlineDiffTimer()')
+
+def _wait_for_preview(render):
+    """
+    Call 'render' again once the worker is done with the diff of the preview
+    it rendered, if it had to wait for it.
+    """
+    global preview_render
+    if nodesData.waiting is not None:
+        preview_render = render
+        vim.command('call s:MundoStartInlineDiffTimer()')
 
+@profiler.operation('preview')
 def MundoRenderPreview():
     if not _check_sanity():
         return
@@ -154,8 +252,6 @@ def MundoRenderPreview():
     else:
         target_state = int(target_state)
 
-    util._goto_window_for_buffer(vim.eval('g:mundo_target_n'))
-
     nodes, nmap = nodesData.make_nodes()
 
     node_after = nmap[target_state]
@@ -163,52 +259,30 @@ def MundoRenderPreview():
 
     vim.command('call s:MundoOpenPreview()')
     util._output_preview_text(nodesData.preview_diff(node_before, node_after))
+    nodesData.restore_current()
+    _wait_for_preview(MundoRenderPreview)
 
     util._goto_window_for_buffer_name('__Mundo__')
 
 def MundoGetTargetState():
     """ Get the current undo number that mundo is at.  """
-    util._goto_window_for_buffer_name('__Mundo__')
-    target_line = vim.eval("getline('.')")
-    matches = re.match('^.* \[([0-9]+)\] .*$',target_line)
-    if matches:
-        return int(matches.group(1))
-    return 0
-
-def GetNextLine(direction,move_count,write,start="line('.')"):
-    start_line_no = int(vim.eval(start))
-    start_line = vim.eval("getline(%d)" % start_line_no)
-    mundo_verbose_graph = vim.eval('g:mundo_verbose_graph')
-    if mundo_verbose_graph != "0":
-        distance = 2
-
-        # If we're in between two nodes we move by one less to get back on track.
-        if start_line.find('[') == -1:
-            distance = distance - 1
-    else:
-      distance = 1
-      nextline = vim.eval("getline(%d)" % (start_line_no+direction))
-      idx1 = nextline.find('@')
-      idx2 = nextline.find('o')
-      idx3 = nextline.find('w')
-      # if the next line is not a revision - then go down one more.
-      if (idx1+idx2+idx3) == -3:
-          distance = distance + 1
-
-    next_line = start_line_no + distance*direction
-    if move_count > 1:
-        return GetNextLine(direction,move_count-1,write,str(next_line))
-    elif write:
-        newline = vim.eval("getline(%d)" % (next_line))
-        if newline.find('w ') == -1:
-            # make sure that if we can't go up/down anymore that we quit out.
-            if direction < 0 and next_line == 1:
-                return next_line
-            if direction > 0 and next_line >= len(vim.current.window.buffer):
-                return next_line
-            return GetNextLine(direction,1,write,str(next_line))
-    return next_line
-
+    if not graph_marks:
+        target_line = util._cursor_line('__Mundo__')
+        if target_line is None:
+            target_line = vim.current.line
+        matches = re.match('^.* \[([0-9]+)\] .*$',target_line)
+        if matches:
+            return int(matches.group(1))
+        return 0
+    row = util._cursor_row('__Mundo__')
+    if row is None:
+        row = vim.current.window.cursor[0] - 1
+    n = graph_marks.at(row)
+    if n is None:
+        return 0
+    return n
+
+@profiler.operation('move')
 def MundoMove(direction,move_count=1,relative=True,write=False):
     """
     Move within the undo graph in the direction specified (or to the specific
@@ -224,45 +298,30 @@ def MundoMove(direction,move_count=1,relative=True,write=False):
 
       write      - If True, move to the next written undo.
     """
+    settings = util.snapshot()
+    if not graph_marks:
+        return
     if relative:
-        target_n = GetNextLine(direction,move_count,write)
-    else:
-        updown = 1
-        if MundoGetTargetState() < direction:
-            updown = -1
-        target_n = GetNextLine(updown,abs(MundoGetTargetState()-direction),write)
-
-    # Bound the movement to the graph.
-    help_lines = 3
-    if int(vim.eval('g:mundo_help')):
-        help_lines = len(INLINE_HELP.split('\n'))
-    if target_n <= help_lines:
-        vim.command("call cursor(%d, 0)" % help_lines)
-    else:
-        vim.command("call cursor(%d, 0)" % target_n)
-
-    line = vim.eval("getline('.')")
-
-    # Move to the node, whether it's an @, o, or w
-    idx1 = line.find('@ ')
-    idx2 = line.find('o ')
-    idx3 = line.find('w ')
-    idxs = []
-    if idx1 != -1:
-        idxs.append(idx1)
-    if idx2 != -1:
-        idxs.append(idx2)
-    if idx3 != -1:
-        idxs.append(idx3)
-    minidx = min(idxs)
-    if idx1 == minidx:
-        vim.command("call cursor(0, %d + 1)" % idx1)
-    elif idx2 == minidx:
-        vim.command("call cursor(0, %d + 1)" % idx2)
+        row = vim.current.window.cursor[0] - 1
+        count = direction * max(move_count, 1)
+        if write:
+            target = graph_marks.move_saved(row, count)
+        else:
+            target = graph_marks.move(row, count)
     else:
-        vim.command("call cursor(0, %d + 1)" % idx3)
-
-    if vim.eval('g:mundo_auto_preview') == '1':
+        if folds.expand(direction):
+            MundoRenderGraph(True, direction)
+        elif direction not in graph_marks:
+            # It's further down than the graph was generated.
+            MundoRenderGraph(False, direction)
+        if direction not in graph_marks:
+            return
+        target = graph_marks.position(direction)
+
+    row, column = graph_marks.mark(target)
+    vim.command("call cursor(%d, %d)" % (row + 1, column + 1))
+
+    if settings.auto_preview == 1:
         MundoRenderPreview()
 
 
@@ -279,6 +338,7 @@ def MundoPrevMatch():
 def MundoNextMatch():
     MundoMatch(1)
 
+@profiler.operation('search')
 def MundoMatch(down):
     """ Jump to the next node that matches the current pattern.  If there is a
     next node, search from the next node to the end of the list of changes. Stop
@@ -286,67 +346,50 @@ def MundoMatch(down):
     if not _check_sanity():
         return
 
-    # save the current window number (should be the navigation window)
-    # then generate the undo nodes, and then go back to the current window.
-    util._goto_window_for_buffer(vim.eval('g:mundo_target_n'))
-
     nodes, nmap = nodesData.make_nodes()
     total = len(nodes) - 1
 
-    util._goto_window_for_buffer_name('__Mundo__')
     mundo_node = MundoGetTargetState()
 
     found_version = -1
     if total > 0:
-        therange = range(mundo_node-1,-1,-1)
+        matches = nodesData.search(vim.eval('@/'))
         if down < 0:
-            therange = range(mundo_node+1,total+1)
-        for version in therange:
-            util._goto_window_for_buffer_name('__Mundo__')
-            undochanges = nodesData.preview_diff(nmap[version].parent, nmap[version])
-            # Look thru all of the changes, ignore the first two b/c those are the
-            # diff timestamp fields (not relevent):
-            for change in undochanges[3:]:
-                match_index = vim.eval('match("%s",@/)'% change.replace("\\","\\\\").replace('"','\\"'))
-                # only consider the matches that are actual additions or
-                # subtractions
-                if int(match_index) >= 0 and (change.startswith('-') or change.startswith('+')):
-                    found_version = version
-                    break
-            # found something, lets get out of here:
-            if found_version != -1:
-                break
+            newer = [version for version in matches if version > mundo_node]
+            if newer:
+                found_version = min(newer)
+        else:
+            older = [version for version in matches if version < mundo_node]
+            if older:
+                found_version = max(older)
     util._goto_window_for_buffer_name('__Mundo__')
     if found_version >= 0:
         MundoMove(found_version,1,False)
 
+@profiler.operation('patch diff')
 def MundoRenderPatchdiff():
-    """ Call MundoRenderChangePreview and display a vert diffpatch with the
-    current file. """
-    if MundoRenderChangePreview():
-        # if there are no lines, do nothing (show a warning).
-        util._goto_window_for_buffer_name('__Mundo_Preview__')
-        if vim.current.buffer[:] == ['']:
-            # restore the cursor position before exiting.
-            util._goto_window_for_buffer_name('__Mundo__')
-            vim.command('unsilent echo "No difference between current file and undo number!"')
-            return False
-
-        # quit out of mundo main screen
-        util._goto_window_for_buffer_name('__Mundo__')
-        vim.command('quit')
-
-        # save the __Mundo_Preview__ buffer to a temp file.
-        util._goto_window_for_buffer_name('__Mundo_Preview__')
-        (handle,filename) = tempfile.mkstemp()
-        vim.command('silent! w %s' % (filename))
-        # exit the __Mundo_Preview__ window
-        vim.command('bdelete')
-        # diff the temp file
-        vim.command('silent! keepalt vert diffpatch %s' % (filename))
-        vim.command('set buftype=nofile bufhidden=delete')
-        return True
-    return False
+    """
+    Show the selected undo state in a vertical diff with the current file.
+    The lines of the state are written from Mundo's caches straight into a
+    scratch buffer.
+    """
+    if not _check_sanity():
+        return False
+
+    nodes, nmap = nodesData.make_nodes()
+    current = nodesData._get_ids(nmap[nodesData.current()])
+    target = nodesData._get_ids(nmap[MundoGetTargetState()])
+    nodesData.restore_current()
+    if current == target:
+        vim.command('unsilent echo "No difference between current file and undo number!"')
+        return False
+
+    # quit out of mundo, and diff the target buffer against the state
+    vim.command('call s:MundoClose()')
+    vim.command('call s:MundoOpenPatchdiff()')
+    util._stream_text(vim.eval("bufnr('%')"), nodesData.table.lines(target))
+    vim.command('diffthis')
+    return True
 
 def MundoGetChangesForLine():
     if not _check_sanity():
@@ -362,14 +405,13 @@ def MundoGetChangesForLine():
     else:
         target_state = int(target_state)
 
-    util._goto_window_for_buffer(vim.eval('g:mundo_target_n'))
-
     nodes, nmap = nodesData.make_nodes()
 
     node_after = nmap[target_state]
     node_before = nmap[nodesData.current()]
     return nodesData.change_preview_diff(node_before, node_after)
 
+@profiler.operation('change preview')
 def MundoRenderChangePreview():
     """ Render the selected undo level with the current file.
     Return True on success, False on failure. """
@@ -378,13 +420,14 @@ def MundoRenderChangePreview():
 
     vim.command('call s:MundoOpenPreview()')
     util._output_preview_text(MundoGetChangesForLine())
+    _wait_for_preview(MundoRenderChangePreview)
 
     util._goto_window_for_buffer_name('__Mundo__')
 
     return True
 
 def MundoRenderToggleInlineDiff():
-    show_inline = int(vim.eval('g:mundo_inline_undo'))
+    show_inline = util.snapshot().inline_undo
     if show_inline == 0:
         vim.command("let g:mundo_inline_undo=1")
     else:
@@ -395,7 +438,7 @@ def MundoRenderToggleInlineDiff():
     vim.command("call cursor(%d,0)" % line)
 
 def MundoToggleHelp():
-    show_help = int(vim.eval('g:mundo_help'))
+    show_help = util.snapshot().help
     if show_help == 0:
         vim.command("let g:mundo_help=1")
     else:
@@ -408,74 +451,181 @@ def MundoToggleHelp():
     vim.command("call cursor(%d, %d)" % (line + new_line_count - old_line_count, column))
 
 # Mundo undo/redo
+@profiler.operation('revert')
 def MundoRevert():
     if not _check_sanity():
         return
 
+    settings = util.settings()
     target_n = MundoGetTargetState()
-    back = vim.eval('g:mundo_target_n')
+    back = settings.target_n
 
     util._goto_window_for_buffer(back)
     util._undo_to(target_n)
 
     vim.command('MundoRenderGraph')
-    if int(vim.eval('g:mundo_return_on_revert')):
+    if settings.return_on_revert:
         util._goto_window_for_buffer(back)
 
-    if int(vim.eval('g:mundo_close_on_revert')):
+    if settings.close_on_revert:
         vim.command('MundoToggle')
 
 def MundoPlayTo():
     if not _check_sanity():
         return
 
+    settings = util.settings()
     target_n = MundoGetTargetState()
-    back = int(vim.eval('g:mundo_target_n'))
-    delay = int(vim.eval('g:mundo_playback_delay'))
+    back = settings.target_n
+    delay = settings.playback_delay
 
     vim.command('echo "%s"' % back)
 
-    util._goto_window_for_buffer(back)
-    util.normal('zR')
-
     nodes, nmap = nodesData.make_nodes()
 
     start = nmap[nodesData.current()]
     end = nmap[target_n]
+    steps = path_between(start, end)
 
-    def _walk_branch(origin, dest):
-        rev = origin.n < dest.n
+    # Make sure the graph is up to date, and reaches down to every step: from
+    # now on, only its '@' marker moves.
+    MundoRenderGraph(False, min([end.n] + [node.n for node in steps]))
+    util._goto_window_for_buffer(back)
+    util.normal('zR')
 
-        nodes = []
-        if origin.n > dest.n:
-            current, final = origin, dest
-        else:
-            current, final = dest, origin
+    previous = start
+    for node in steps:
+        util._undo_to(node.n)
+        _move_marker(previous, node)
+        previous = node
+        vim.command('redraw')
+        vim.command('sleep %dm' % delay)
 
-        while current.n >= final.n:
-            if current.n == final.n:
-                break
-            nodes.append(current)
-            current = current.parent
-        else:
-            return None
-        nodes.append(current)
+    if steps:
+        MundoRenderGraph()
+        util._goto_window_for_buffer(back)
 
-        if rev:
-            return reversed(nodes)
-        else:
-            return nodes
+def _move_marker(old, new):
+    """
+    Move the '@' marker of the rendered graph from node 'old' to node 'new',
+    and the cursor of the graph along with it, without rendering it again.
+    States in a folded run move the marker of its row.
+    """
+    global graph_lines
+    lines = list(graph_lines)
+    old_char = 'w' if old.saved else 'o'
+    if old.n in folds.chains:
+        old_char = ':'
+    for node, char in ((old, old_char), (new, '@')):
+        row, column = graph_marks[folds.shown(node.n)]
+        lines[row] = lines[row][:column] + char + lines[row][column + 1:]
+
+    vim.command('call setbufvar(%d, "&modifiable", 1)' % graph_buffer)
+    util._update_buffer(util._buffer(graph_buffer), graph_lines, lines)
+    vim.command('call setbufvar(%d, "&modifiable", 0)' % graph_buffer)
+    graph_lines = lines
+
+    row, column = graph_marks[folds.shown(new.n)]
+    util._in_buffer(graph_buffer, 'call cursor(%d, %d) | normal! zz' % (row + 1, column + 1))
+
+def MundoFold(expand):
+    """
+    Expand the folded run of states under the cursor, or fold back the run
+    of the state under the cursor.
+    """
+    n = MundoGetTargetState()
+    if expand:
+        changed = folds.expand(n)
+    else:
+        changed = folds.fold(n)
+        n = folds.runs.get(n, n)
+    if not changed:
+        return
+    MundoRenderGraph(True)
+    MundoMove(folds.shown(n), 1, False)
+
+# Mundo export
+EXPORT_USAGE = 'Usage: :MundoExport [{from}] [{to}] [{file}]'
 
-    branch = _walk_branch(start, end)
+@profiler.operation('export')
+def MundoExport(args):
+    """
+    Export the changes from one state to another as a series of unified
+    diffs, one per step, to the file named in 'args' or to a scratch buffer.
 
-    if not branch:
-        vim.command('unsilent echo "No path to that node from here!"')
+    Two states in 'args' are the first and the last state. With only one,
+    the changes start from the original text. With none, they lead from the
+    original text to the state under the cursor of the graph, or to the
+    current state when exporting from another window.
+    """
+    if not _check_sanity():
         return
 
-    for node in branch:
-        util._undo_to(node.n)
-        vim.command('MundoRenderGraph')
-        util.normal('zz')
-        util._goto_window_for_buffer(back)
-        vim.command('redraw')
-        vim.command('sleep %dm' % delay)
+    # Arguments made of digits only are states: a file named like one can
+    # be given as ./123.
+    states = [int(arg) for arg in args if arg.isdigit()]
+    names = [arg for arg in args if not arg.isdigit()]
+    if len(states) > 2 or len(names) > 1:
+        vim.command('echoerr "%s"' % EXPORT_USAGE)
+        return
+
+    nodes, nmap = nodesData.make_nodes()
+    if not states:
+        if vim.eval("bufname('%')") == '__Mundo__':
+            states = [MundoGetTargetState()]
+        else:
+            states = [nodesData.current()]
+    if len(states) == 1:
+        states.insert(0, 0)
+    for n in states:
+        if n not in nmap:
+            vim.command('echoerr "Unknown undo state: %d"' % n)
+            return
+
+    series = nodesData.patch_series(nmap[states[0]], nmap[states[1]])
+    lines = (line.rstrip('\n') for line in series)
+    if names:
+        filename = os.path.expanduser(names[0])
+        quoted = filename.replace('\\', '\\\\').replace('"', '\\"')
+        count = 0
+        try:
+            with open(filename, 'wb') as f:
+                for line in lines:
+                    f.write(_bytes(line + '\n'))
+                    count += 1
+        except (IOError, OSError) as e:
+            # Put the target buffer back.
+            series.close()
+            vim.command('echoerr "Cannot write %s: %s"' %
+                        (quoted, str(e.strerror or e).replace('"', '\\"')))
+            return
+        vim.command('echo "%d lines written to %s"' % (count, quoted))
+    else:
+        vim.command('call s:MundoOpenExport()')
+        util._stream_text(vim.eval("bufnr('%')"), lines)
+
+# Mundo profiler
+def MundoProfile(action=''):
+    """
+    Turn the profiler 'on' or 'off', 'reset' what it timed so far, or show a
+    report of it in a scratch buffer.
+    """
+    if action == 'on':
+        profiler.enable()
+    elif action == 'off':
+        profiler.enable(False)
+    elif action == 'reset':
+        profiler.clear()
+    elif action == '':
+        vim.command('call s:MundoOpenProfile()')
+        util._output_text(profiler.report())
+    else:
+        vim.command('echoerr "Unknown :MundoProfile action: %s"' % action.replace('"', '\\"'))
+
+def MundoStats():
+    """ Return the counters and the memory use of Mundo (see mundo#Stats()). """
+    stats = dict(util.counters)
+    stats['renders'] = dict(render_stats)
+    stats['caches'] = nodesData.cache_stats()
+    stats['memory'] = nodesData.memory_stats()
+    return stats
@@ -94,6 +94,8 @@ function! s:MundoMapGraph()"{{{
     nnoremap <script> <silent> <buffer> K             :<C-u>call <sid>MundoPython('MundoMove(-1,'. v:count .',True,True)')<CR>
     nnoremap <script> <silent> <buffer> gg            gg:<C-u>call <sid>MundoPython('MundoMove(1,'. v:count .')')<CR>
     nnoremap <script> <silent> <buffer> P             :call <sid>MundoPython('MundoPlayTo()')<CR>
+    nnoremap <script> <silent> <buffer> zo            :call <sid>MundoPython('MundoFold(True)')<CR>
+    nnoremap <script> <silent> <buffer> zc            :call <sid>MundoPython('MundoFold(False)')<CR>
     nnoremap <script> <silent> <buffer> d             :call <sid>MundoPython('MundoRenderPatchdiff()')<CR>
     nnoremap <script> <silent> <buffer> i             :call <sid>MundoPython('MundoRenderToggleInlineDiff()')<CR>
     nnoremap <script> <silent> <buffer> /             :call <sid>MundoPython('MundoSearch()')<CR>
@@ -151,6 +153,7 @@ function! s:MundoSyntaxGraph()"{{{
     syn match MundoCurrentLocation '@'
     syn match MundoHelp '\v^".*$'
     syn match MundoNumberField '\v\[[0-9]+\]'
+    syn match MundoNumberField '\v\[[0-9]+\.\.[0-9]+\]'
     syn match MundoNumber '\v[0-9]+' contained containedin=MundoNumberField
     syn region MundoDiff start=/\v<ago> / end=/$/
     syn match MundoDiffAdd '\v\+[^+-]+\+' contained containedin=MundoDiff
@@ -256,6 +259,53 @@ function! s:MundoOpenPreview()"{{{
     endif
 endfunction"}}}
 
+function! s:MundoOpenProfile()"{{{
+    let existing_profile_window = bufwinnr("__Mundo_Profile__")
+
+    if existing_profile_window != -1
+        exe existing_profile_window . "wincmd w"
+    else
+        exe "botright keepalt new __Mundo_Profile__"
+        setlocal buftype=nofile
+        setlocal bufhidden=wipe
+        setlocal noswapfile
+        setlocal nobuflisted
+        setlocal nomodifiable
+        setlocal nonumber
+        setlocal norelativenumber
+        setlocal nowrap
+        nnoremap <script> <silent> <buffer> q :quit<CR>
+    endif
+endfunction"}}}
+
+function! s:MundoOpenExport()"{{{
+    let existing_export_window = bufwinnr("__Mundo_Export__")
+
+    if existing_export_window != -1
+        exe existing_export_window . "wincmd w"
+    else
+        exe "botright keepalt new __Mundo_Export__"
+        setlocal buftype=nofile
+        setlocal bufhidden=hide
+        setlocal noswapfile
+        setlocal nobuflisted
+        setlocal nomodifiable
+        setlocal filetype=diff
+        nnoremap <script> <silent> <buffer> q :quit<CR>
+    endif
+endfunction"}}}
+
+function! s:MundoOpenPatchdiff()"{{{
+    let filetype = getbufvar(g:mundo_target_n, '&filetype')
+    diffthis
+    keepalt vnew
+    setlocal buftype=nofile
+    setlocal bufhidden=wipe
+    setlocal noswapfile
+    setlocal nobuflisted
+    let &l:filetype = filetype
+endfunction"}}}
+
 function! s:MundoClose()"{{{
     if s:MundoGoToWindowForBufferName('__Mundo__')
         quit
@@ -274,7 +324,7 @@ function! s:InitPythonModule(python)
 endfunction
 
 
-function! s:MundoOpen()"{{{
+function! s:MundoLoadPython()"{{{
     if !exists('g:mundo_py_loaded')
         if s:has_supported_python == 2
             exe 'py3file ' . escape(s:plugin_path, ' ') . '/mundo.py'
@@ -290,11 +340,18 @@ function! s:MundoOpen()"{{{
             endfunction
             command! -nargs=0 MundoToggle call s:MundoDidNotLoad()
             call s:MundoDidNotLoad()
-            return
+            return 0
         endif
 
         let g:mundo_py_loaded = 1
     endif
+    return 1
+endfunction"}}}
+
+function! s:MundoOpen()"{{{
+    if !s:MundoLoadPython()
+        return
+    endif
 
     " Save `splitbelow` value and set it to default to avoid problems with
     " positioning new windows.
@@ -368,6 +425,82 @@ function! s:MundoPython(fn)"{{{
     endif
 endfunction"}}}
 
+function! s:MundoPythonEval(expr)"{{{
+    if s:has_supported_python == 2
+        return py3eval(a:expr)
+    else
+        return pyeval(a:expr)
+    endif
+endfunction"}}}
+
+"}}}
+
+"{{{ Mundo inline diffs
+
+" Inline diffs are summarized in the background; poll for them with a timer.
+let s:inline_diff_poll = 50
+
+function! s:MundoStartInlineDiffTimer()"{{{
+    if !exists('s:inline_diff_timer')
+        let s:inline_diff_timer = timer_start(s:inline_diff_poll, function('s:MundoInlineDiffTimer'))
+    endif
+endfunction"}}}
+
+function! s:MundoInlineDiffTimer(timer)"{{{
+    unlet s:inline_diff_timer
+    if bufwinnr('__Mundo__') == -1
+        return
+    endif
+    " Don't render in the middle of an insert or a command: try again later.
+    if mode() !=# 'n'
+        call s:MundoStartInlineDiffTimer()
+        return
+    endif
+
+    let currentWin = winnr()
+    let winView = winsaveview()
+    call s:MundoPython('MundoPollInlineDiffs()')
+
+    " switch back to previous window
+    execute currentWin .'wincmd w'
+    call winrestview(winView)
+endfunction"}}}
+
+"}}}
+
+"{{{ Mundo diff worker
+
+" The worker's responses are read by polling, so nothing may drop them.
+function! s:MundoWorkerStart(command)"{{{
+    if !exists('*job_start')
+        return 0
+    endif
+    let s:worker = job_start(a:command, {'mode': 'nl', 'drop': 'never', 'err_io': 'null'})
+    return job_status(s:worker) ==# 'run'
+endfunction"}}}
+
+function! s:MundoWorkerSend(line)"{{{
+    if !exists('s:worker') || job_status(s:worker) !=# 'run'
+        return 0
+    endif
+    call ch_sendraw(s:worker, a:line . "\n")
+    return 1
+endfunction"}}}
+
+function! s:MundoWorkerRead(timeout)"{{{
+    if !exists('s:worker') || ch_status(s:worker) !~# '^\(open\|buffered\)$'
+        return ''
+    endif
+    return ch_read(s:worker, {'timeout': a:timeout})
+endfunction"}}}
+
+function! s:MundoWorkerStop()"{{{
+    if exists('s:worker')
+        call job_stop(s:worker, 'kill')
+        unlet s:worker
+    endif
+endfunction"}}}
+
 "}}}
 
 "{{{ Misc
@@ -388,10 +521,56 @@ function! mundo#MundoRenderGraph()"{{{
     call s:MundoPython('MundoRenderGraph()')
 endfunction"}}}
 
+function! mundo#MundoProfile(action)"{{{
+    call s:MundoSetupPythonPath()
+    if s:MundoLoadPython()
+        call s:MundoPython('MundoProfile("' . escape(a:action, '\"') . '")')
+    endif
+endfunction"}}}
+
+function! mundo#MundoExport(args)"{{{
+    call s:MundoSetupPythonPath()
+    if !s:MundoLoadPython()
+        return
+    endif
+    " Outside of Mundo, export the history of the current buffer.
+    if !s:MundoIsVisible()
+        let g:mundo_target_n = bufnr('')
+        let g:mundo_target_f = @%
+    endif
+    let g:mundo_export_args = a:args
+    try
+        call s:MundoPython('MundoExport(vim.eval("g:mundo_export_args"))')
+    finally
+        unlet g:mundo_export_args
+    endtry
+endfunction"}}}
+
+function! mundo#MundoProfileComplete(arglead, cmdline, cursorpos)"{{{
+    return "on\noff\nreset"
+endfunction"}}}
+
 " automatically reload Mundo buffer if open
-function! s:MundoRefresh()"{{{
-  " abort when there were no changes
+"
+" Bursts of CursorMoved/CursorHold events are coalesced into a single render
+" once g:mundo_refresh_delay milliseconds passed without another one, and no
+" render happens at all while the target buffer and the graph's viewport are
+" the same as after the last one.
+let s:refresh_stats = {'requested': 0, 'rendered': 0, 'unchanged': 0, 'coalesced': 0}
+let s:refresh_state = []
+
+function! s:MundoRefreshState()"{{{
+  let state = [g:mundo_target_n, getbufvar(g:mundo_target_n, 'changedtick')]
+  if exists('*getwininfo')
+    let info = getwininfo(win_getid(bufwinnr('__Mundo__')))
+    if !empty(info)
+      call extend(state, [info[0].topline, info[0].botline])
+    endif
+  endif
+  return state
+endfunction"}}}
 
+function! s:MundoRefresh()"{{{
   let mundoWin    = bufwinnr('__Mundo__')
   let mundoPreWin = bufwinnr('__Mundo_Preview__')
   let currentWin  = bufwinnr('%')
@@ -401,12 +580,55 @@ function! s:MundoRefresh()"{{{
     return
   endif
 
+  let s:refresh_stats.requested += 1
+
+  " abort when there were no changes
+  if s:MundoRefreshState() ==# s:refresh_state
+    let s:refresh_stats.unchanged += 1
+    return
+  endif
+
+  if g:mundo_refresh_delay > 0 && has('timers')
+    if exists('s:refresh_timer')
+      call timer_stop(s:refresh_timer)
+      let s:refresh_stats.coalesced += 1
+    endif
+    let s:refresh_timer = timer_start(g:mundo_refresh_delay, function('s:MundoRefreshTimer'))
+  else
+    call s:MundoRefreshNow()
+  endif
+endfunction"}}}
+
+function! s:MundoRefreshTimer(timer)"{{{
+  unlet s:refresh_timer
+
+  " the next CursorMoved will try again
+  if bufwinnr('__Mundo__') == -1 || bufwinnr('__Mundo_Preview__') == -1 || mode() !=# 'n'
+    return
+  endif
+
+  call s:MundoRefreshNow()
+endfunction"}}}
+
+function! s:MundoRefreshNow()"{{{
+  let currentWin = winnr()
   let winView = winsaveview()
   :MundoRenderGraph
 
   " switch back to previous window
   execute currentWin .'wincmd w'
   call winrestview(winView)
+
+  let s:refresh_state = s:MundoRefreshState()
+  let s:refresh_stats.rendered += 1
+endfunction"}}}
+
+function! mundo#Stats()"{{{
+  let stats = {'refresh': copy(s:refresh_stats)}
+  if exists('g:mundo_py_loaded')
+    call extend(stats, s:MundoPythonEval('MundoStats()'))
+  endif
+  return stats
 endfunction"}}}
 
 augroup MundoAug
@@ -0,0 +1,117 @@
+import collections
+import sys
+
+def sizeof(value):
+    """
+    Measure the number of bytes held by a cached value: a string, or a list
+    of strings (a buffer snapshot or a unified diff).
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            size += sys.getsizeof(item)
+    return size
+
+def measure(value, seen):
+    """
+    Measure the number of bytes held by 'value' and by the dicts, lists,
+    tuples, sets and strings it contains. Objects whose id is in the set
+    'seen' are skipped, and the ones measured are added to it, so shared
+    objects are only counted once.
+    """
+    size = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(value)
+    return size
+
+class LRUCache(object):
+    """
+    A dictionary-like cache that holds at most 'max_bytes' worth of values,
+    evicting the least recently used entries first.
+
+    Keeps hit/miss/eviction counters so that callers can tell how well the
+    budget fits their history.
+    """
+    def __init__(self, max_bytes, sizeof=sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clear()
+
+    def clear(self):
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            # Never going to fit: keeping it would flush everything else.
+            self.evictions += 1
+            return
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.bytes += size
+        self._evict()
+
+    def get(self, key, default=None):
+        """ Return the value for 'key', marking it as recently used. """
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def pop(self, key):
+        if key in self.entries:
+            self.bytes -= self.sizes.pop(key)
+            return self.entries.pop(key)
+        return None
+
+    def resize(self, max_bytes):
+        """ Change the budget, evicting entries if it shrank. """
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            self.pop(key)
+            self.evictions += 1
@@ -1,6 +1,13 @@
 import difflib
 import itertools
 
+# Lines of unchanged context kept around each hunk of the line diff.
+CONTEXT = 3
+
+# Hunks larger than this (before and after, in characters) are not matched
+# character by character: only their common prefix and suffix are found.
+MATCHER_MAX_CHARS = 2000
+
 # one line diff functions.
 def one_line_diff_str(before,after,mx=15,pre=2):
     """
@@ -13,14 +20,15 @@ def one_line_diff_str(before,after,mx=15,pre=2):
       mx     - the max number of strings.
       pre    - number of characters to show before diff (context)
 
-    Returns a string no longer than 'mx'.
+    Returns a string no longer than 'mx'. Hunks are only summarized until
+    'mx' characters are known, so the cost doesn't grow with the rest of
+    the change.
     """
-    old = one_line_diff(before,after)
     result = ''
     firstEl = True
     # TODO instead of using +addition+ and -subtraction- it'd be nice to be able
     # to highlight the change w/o requiring the +/- chars.
-    for v in old:
+    for v in _one_line_diff(before,after):
         # if the first element doesn't have a change, then don't include it.
         v = escape_returns(v)
         if firstEl:
@@ -47,29 +55,110 @@ def one_line_diff(before, after):
 
     Returns a list of strings, summarizing all the changes.
     """
-    a, b, result = [], [], []
+    return list(_one_line_diff(before, after))
+
+def _one_line_diff(before, after):
+    """
+    Generate the pieces of one_line_diff(), one hunk at a time.
+
+    The last piece is held back until the end, as a trailing newline that
+    was added is reported as part of it.
+    """
+    last = None
+    for a, b in _hunks(before, after):
+        for piece in one_line_diff_raw(a, b):
+            if last is not None:
+                yield last
+            last = piece
+    if after.endswith('\n') and not before.endswith('\n'):
+        if last is not None:
+            last = last[:-1] + '\n+'
+        else:
+            last = '+\n+'
+    if last is not None:
+        yield last
+
+def _hunks(before, after):
+    """
+    Generate the (before, after) text of each hunk of the line diff.
+
+    Past MATCHER_MAX_CHARS, lines common to the start and end of both
+    strings are dropped (but for the context shown around the first and
+    last hunks) before the line diff is made. That can align repeated lines
+    differently, so smaller strings are diffed whole.
+    """
+    a, b = before.splitlines(), after.splitlines()
+    if len(before) + len(after) > MATCHER_MAX_CHARS:
+        start = _common_prefix(a, b)
+        end = _common_suffix(a, b, start)
+        start = max(start - CONTEXT, 0)
+        end = max(end - CONTEXT, 0)
+        a = a[start:len(a) - end]
+        b = b[start:len(b) - end]
+
+    old, new = [], []
     for line in itertools.chain(itertools.islice(
-        difflib.unified_diff(before.splitlines(),
-                             after.splitlines()), 2, None), ['@@']):
+        difflib.unified_diff(a, b, n=CONTEXT), 2, None), ['@@']):
         if line.startswith('@@'):
-            result.extend(one_line_diff_raw('\n'.join(a), '\n'.join(b)))
-            a, b = [], []
+            if old or new:
+                yield '\n'.join(old), '\n'.join(new)
+            old, new = [], []
             continue
         if not line.startswith('+'):
-            a.append(line[1:])
+            old.append(line[1:])
         if not line.startswith('-'):
-            b.append(line[1:])
-    if after.endswith('\n') and not before.endswith('\n'):
-        if result:
-            result[-1] = result[-1][:-1] + '\n+'
-        else:
-            result = ['+\n+']
-    return result
+            new.append(line[1:])
+
+def _common_prefix(a, b):
+    """ Return the length of the common prefix of two sequences. """
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def _common_suffix(a, b, prefix=0):
+    """ Return the length of the common suffix not overlapping 'prefix'. """
+    n = min(len(a), len(b)) - prefix
+    i = 0
+    while i < n and a[-1 - i] == b[-1 - i]:
+        i += 1
+    return i
+
+def _char_opcodes(before, after):
+    """
+    Return the SequenceMatcher opcodes turning 'before' into 'after'.
+
+    Large inputs are trimmed to the part between their common prefix and
+    suffix first; if that is still too large to match it is reported as a
+    single change.
+    """
+    if len(before) + len(after) <= MATCHER_MAX_CHARS:
+        return difflib.SequenceMatcher(None, before, after).get_opcodes()
+
+    start = _common_prefix(before, after)
+    end = _common_suffix(before, after, start)
+    i2, j2 = len(before) - end, len(after) - end
+    opcodes = []
+    if start:
+        opcodes.append(('equal', 0, start, 0, start))
+    if (i2 - start) + (j2 - start) <= MATCHER_MAX_CHARS:
+        matcher = difflib.SequenceMatcher(None, before[start:i2], after[start:j2])
+        for tag, a1, a2, b1, b2 in matcher.get_opcodes():
+            opcodes.append((tag, start + a1, start + a2, start + b1, start + b2))
+    elif i2 > start and j2 > start:
+        opcodes.append(('replace', start, i2, start, j2))
+    elif i2 > start:
+        opcodes.append(('delete', start, i2, start, j2))
+    elif j2 > start:
+        opcodes.append(('insert', start, i2, start, j2))
+    if end:
+        opcodes.append(('equal', i2, len(before), j2, len(after)))
+    return opcodes
 
 def one_line_diff_raw(before,after):
-  s = difflib.SequenceMatcher(None,before,after)
   results = []
-  for tag, i1, i2, j1, j2 in s.get_opcodes():
+  for tag, i1, i2, j1, j2 in _char_opcodes(before,after):
     #print ("%7s a[%d:%d] (%s) b[%d:%d] (%s)" % (tag, i1, i2, before[i1:i2], j1, j2, after[j1:j2]))
     if tag == 'equal':
       _append_result(results,{
@@ -0,0 +1,225 @@
+import collections
+import json
+import os
+import threading
+import time
+from mundo import diff, util
+from mundo.diskcache import _native
+
+# Diffs of fewer lines than this are quicker to match in Vim than to send to
+# the worker.
+WORKER_MIN_LINES = 2000
+
+# Returned by opcodes() while the worker is matching the lines.
+PENDING = 'pending'
+
+class Timeout(Exception):
+    """ The worker took too long, and was restarted. """
+
+class DiffQueue(object):
+    """
+    Computes one line diff summaries on a background thread.
+
+    Every render starts a new round: summaries that were requested by an
+    earlier round and haven't been started yet are dropped, so the rows
+    currently on screen are always the first ones to be summarized.
+    """
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.pending = collections.OrderedDict()
+        self.running = None
+        self.done = {}
+        self.thread = None
+
+    def next_round(self):
+        with self.lock:
+            self.pending.clear()
+
+    def submit(self, key, before, after, width):
+        """ Queue the summary of the change from 'before' to 'after'. """
+        with self.lock:
+            if key in self.pending or key == self.running or key in self.done:
+                return
+            self.pending[key] = (before, after, width)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.lock.notify()
+
+    def results(self):
+        """ Return (and forget) the summaries computed since the last call. """
+        with self.lock:
+            done, self.done = self.done, {}
+        return done
+
+    def busy(self):
+        """ Return True while summaries are queued or being computed. """
+        with self.lock:
+            return bool(self.pending) or self.running is not None
+
+    def opcodes(self, key, a, b, context):
+        """
+        Return the grouped opcodes matching the line id arrays 'a' and 'b'
+        (known as 'key'), or None to match them in Vim.
+        """
+        return None
+
+    def answered(self, key):
+        """ Return True once opcodes() won't return PENDING for 'key'. """
+        return True
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.lock.wait()
+                key, args = self.pending.popitem(last=False)
+                self.running = key
+
+            summary = diff.one_line_diff_str(*args)
+
+            with self.lock:
+                self.done[key] = summary
+                self.running = None
+
+class WorkerQueue(DiffQueue):
+    """
+    A DiffQueue that sends its work to a worker process (see worker.py) on
+    a Vim job channel, one request at a time, and reads the responses when
+    polled.
+
+    The opcodes of a preview are asked for the same way: until they are
+    read, opcodes() returns PENDING and Vim is never kept waiting. Only the
+    last preview asked for is matched, before any queued summary.
+
+    Requests that take longer than 'timeout' milliseconds are cancelled by
+    restarting the worker. When the worker can't be (re)started, summaries
+    are computed on the background thread of DiffQueue instead.
+    """
+    def __init__(self, python, timeout):
+        DiffQueue.__init__(self)
+        self.command = [python, os.path.join(os.path.dirname(__file__), 'worker.py')]
+        self.timeout = timeout
+        self.cancelled = set()
+        # The request being worked on: (id, key, start time, kind).
+        self.request = None
+        self.last_id = 0
+        # The preview waiting to be sent: (key, a, b, context).
+        self.preview = None
+        # key -> grouped opcodes read from the worker
+        self.groups = {}
+        self.alive = util._worker_start(self.command)
+
+    def submit(self, key, before, after, width):
+        if not self.alive:
+            return DiffQueue.submit(self, key, before, after, width)
+        with self.lock:
+            if key in self.pending or key in self.done or key in self.cancelled:
+                return
+            if self.request and self.request[1] == key:
+                return
+            self.pending[key] = (before, after, width)
+        self._send_next()
+
+    def results(self):
+        if self.request:
+            self._read()
+        return DiffQueue.results(self)
+
+    def busy(self):
+        return (DiffQueue.busy(self) or self.request is not None or
+                self.preview is not None)
+
+    def opcodes(self, key, a, b, context):
+        """
+        Return the grouped opcodes of 'a' and 'b' once the worker matched
+        them, PENDING until then, or None to match them in Vim. Raise
+        Timeout if the worker took too long.
+        """
+        if not self.alive or len(a) + len(b) < WORKER_MIN_LINES:
+            return None
+        if key in self.groups:
+            return self.groups.pop(key)
+        if key in self.cancelled:
+            raise Timeout()
+        if not (self.request and self.request[1] == key):
+            self.preview = (key, list(a), list(b), context)
+            self._send_next()
+        return PENDING
+
+    def answered(self, key):
+        if self.request:
+            self._read()
+        return key in self.groups or key in self.cancelled or not self.alive
+
+    def _send_next(self):
+        while self.alive and self.request is None:
+            if self.preview:
+                key, a, b, context = self.preview
+                self.preview = None
+                self._send(key, 'opcodes', a, b, context)
+                continue
+            with self.lock:
+                if not self.pending:
+                    return
+                key, args = self.pending.popitem(last=False)
+            if not self._send(key, 'summary', *args):
+                # It can't go to the worker: summarize it here.
+                DiffQueue.submit(self, key, *args)
+
+    def _send(self, key, kind, *args):
+        """ Send a request to the worker, and return True if it was. """
+        try:
+            line = json.dumps([self.last_id + 1, kind] + list(args))
+        except ValueError:
+            # Not valid UTF-8 text (Python 2).
+            return False
+        if not util._worker_send(line):
+            self.alive = False
+            return False
+        self.last_id += 1
+        self.request = (self.last_id, key, time.time(), kind)
+        return True
+
+    def _read(self):
+        """
+        Read the responses the worker sent so far, without waiting, and
+        restart it if the current request is overdue.
+        """
+        while self.request:
+            line = util._worker_read(0)
+            if not line:
+                if time.time() - self.request[2] > self.timeout / 1000.0:
+                    self._restart()
+                return
+            response = json.loads(line)
+            if response[0] != self.request[0]:
+                continue
+            key, kind = self.request[1], self.request[3]
+            self.request = None
+            with self.lock:
+                if response[1] is None:
+                    self.cancelled.add(key)
+                elif kind == 'opcodes':
+                    # Only the last preview is asked for again.
+                    self.groups = {key: response[1]}
+                else:
+                    self.done[key] = _native(response[1])
+            self._send_next()
+
+    def _restart(self):
+        """ Cancel the current request by restarting the worker. """
+        key = self.request[1]
+        self.request = None
+        with self.lock:
+            self.cancelled.add(key)
+        util._worker_stop()
+        self.alive = util._worker_start(self.command)
+        if not self.alive:
+            with self.lock:
+                pending = list(self.pending.items())
+                self.pending.clear()
+            for key, args in pending:
+                DiffQueue.submit(self, key, *args)
+        self._send_next()
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import mmap
+import os
+
+# Bumped whenever the layout of the records changes.
+VERSION = 1
+
+def _bytes(s):
+    if isinstance(s, bytes):
+        return s
+    return s.encode('utf-8')
+
+def _native(value):
+    """ Turn the unicode json gives back on Python 2 into plain strings. """
+    if isinstance(value, list):
+        return [_native(v) for v in value]
+    if not isinstance(value, str) and not isinstance(value, bytes):
+        return value.encode('utf-8')
+    return value
+
+def open_cache(directory, path, undofile, seq_last, oldest):
+    """
+    Return the DiskCache of file 'path' in 'directory', or None if it can't
+    be used.
+
+    'undofile' is the name of the undo file of 'path', and 'oldest' the
+    (number, time) of the oldest state of its undo tree: whenever either of
+    them changes, the history was replaced and the cache is discarded.
+    """
+    header = 'mundo-cache %s\t%s\n' % (VERSION, json.dumps([path, undofile, oldest]))
+    name = hashlib.sha1(_bytes(path)).hexdigest() + '.cache'
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return DiskCache(os.path.join(directory, name), _bytes(header), seq_last)
+    except (EnvironmentError, ValueError):
+        return None
+
+class DiskCache(object):
+    """
+    An append-only file of diffs and summaries, one record per line:
+
+        key <tab> state number <tab> json value
+
+    The file is memory-mapped and indexed by key when it is opened, but
+    values are only decoded when they are asked for. Keys include the times
+    of the states they compare, so records of states that have since been
+    replaced are simply never asked for again.
+    """
+    def __init__(self, filename, header, seq_last):
+        self.filename = filename
+        self.index = {}
+        self.data = None
+        self.mapped = 0
+        self.size = self._load(header, seq_last)
+        self.out = open(filename, 'ab')
+        self.f = open(filename, 'rb')
+
+    def _load(self, header, seq_last):
+        """ Index the records of the file, and return the size to keep. """
+        data = b''
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        size = 0
+        if data[:len(header)] == header:
+            size = pos = len(header)
+            while True:
+                end = data.find(b'\n', pos)
+                if end < 0:
+                    # An interrupted write: drop what's left of it.
+                    break
+                try:
+                    key, seq, rest = data[pos:end].split(b'\t', 2)
+                    seq = int(seq)
+                except ValueError:
+                    # A damaged record: drop it, and everything after it.
+                    break
+                if seq > seq_last:
+                    # These states were undone out of existence: it's
+                    # a different history.
+                    self.index = {}
+                    size = 0
+                    break
+                self.index[key] = (end - len(rest), end)
+                size = pos = end + 1
+
+        length = len(data)
+        if length:
+            data.close()
+        if size == 0:
+            with open(self.filename, 'wb') as f:
+                f.write(header)
+            return len(header)
+        if size < length:
+            with open(self.filename, 'r+b') as f:
+                f.truncate(size)
+        return size
+
+    def __contains__(self, key):
+        return _bytes(key) in self.index
+
+    def get(self, key):
+        """ Return the value stored for 'key', or None. """
+        location = self.index.get(_bytes(key))
+        if location is None:
+            return None
+        start, end = location
+        if end > self.mapped:
+            self._map()
+        return _native(json.loads(self.data[start:end].decode('utf-8')))
+
+    def put(self, key, seq, value):
+        """ Append 'value' for 'key', the diff of states up to number 'seq'. """
+        key = _bytes(key)
+        if key in self.index:
+            return
+        try:
+            value = _bytes(json.dumps(value))
+        except ValueError:
+            # Not valid UTF-8 text (Python 2): just don't keep it.
+            return
+        prefix = key + b'\t' + _bytes(str(seq)) + b'\t'
+        self.out.write(prefix + value + b'\n')
+        self.out.flush()
+        start = self.size + len(prefix)
+        self.index[key] = (start, start + len(value))
+        self.size = start + len(value) + 1
+
+    def _map(self):
+        if self.data is not None:
+            self.data.close()
+        self.data = mmap.mmap(self.f.fileno(), self.size, access=mmap.ACCESS_READ)
+        self.mapped = self.size
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.out.close()
+        self.f.close()
@@ -1,13 +1,51 @@
 import time
-import util
+from mundo.profiler import profiler
 
 
+class Columns(object):
+    """
+    The ongoing edges of the graph, as the list of the nodes they lead to,
+    along with the column of each node: the columns of a node and of its
+    parents are looked up rather than searched for, however many branches
+    are ongoing.
+    """
+    __slots__ = ('nodes', 'index')
+
+    def __init__(self):
+        self.nodes = []
+        self.index = {}
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def append(self, node):
+        self.index[node] = len(self.nodes)
+        self.nodes.append(node)
+
+    def replace(self, i, nodes):
+        """ Replace the node of column 'i' with 'nodes'. """
+        del self.index[self.nodes[i]]
+        if len(nodes) == 1:
+            self.nodes[i] = nodes[0]
+            self.index[nodes[0]] = i
+            return
+        self.nodes[i:i + 1] = nodes
+        index = self.index
+        for j in range(i, len(self.nodes)):
+            index[self.nodes[j]] = j
+
 # Mercurial's graphlog code -------------------------------------------------------
 def asciiedges(seen, rev, parents):
-    """adds edge info to changelog DAG walk suitable for ascii()"""
+    """adds edge info to changelog DAG walk suitable for ascii()
+
+    'seen' holds the Columns of the ongoing edges.
+    """
     if rev not in seen:
         seen.append(rev)
-    nodeidx = seen.index(rev)
+    nodeidx = seen.index[rev]
 
     knownparents = []
     newparents = []
@@ -18,8 +56,8 @@ def asciiedges(seen, rev, parents):
             newparents.append(parent)
 
     ncols = len(seen)
-    seen[nodeidx:nodeidx + 1] = newparents
-    edges = [(nodeidx, seen.index(p)) for p in knownparents]
+    seen.replace(nodeidx, newparents)
+    edges = [(nodeidx, seen.index[p]) for p in knownparents]
 
     if len(newparents) > 0:
         edges.append((nodeidx, nodeidx))
@@ -36,30 +74,35 @@ def get_nodeline_edges_tail(
         # Still going in the same non-vertical direction.
         if n_columns_diff == -1:
             start = max(node_index + 1, p_node_index)
-            tail = ["|", " "] * (start - node_index - 1)
-            tail.extend(["/", " "] * (n_columns - start))
-            return tail
+            return "| " * (start - node_index - 1) + "/ " * (n_columns - start)
         else:
-            return ["\\", " "] * (n_columns - node_index - 1)
+            return "\\ " * (n_columns - node_index - 1)
     else:
-        return ["|", " "] * (n_columns - node_index - 1)
+        return "| " * (n_columns - node_index - 1)
+
+
+def _put(line, i, char):
+    return line[:i] + char + line[i + 1:]
 
 
 def draw_edges(edges, nodeline, interline):
+    """ Return 'nodeline' and 'interline' with 'edges' drawn on them. """
     for (start, end) in edges:
         if start == end + 1:
-            interline[2 * end + 1] = "/"
+            interline = _put(interline, 2 * end + 1, "/")
         elif start == end - 1:
-            interline[2 * start + 1] = "\\"
+            interline = _put(interline, 2 * start + 1, "\\")
         elif start == end:
-            interline[2 * start] = "|"
+            interline = _put(interline, 2 * start, "|")
         else:
-            nodeline[2 * end] = "+"
+            nodeline = list(_put(nodeline, 2 * end, "+"))
             if start > end:
                 (start, end) = (end, start)
             for i in range(2 * start + 1, 2 * end):
                 if nodeline[i] != "+":
                     nodeline[i] = "-"
+            nodeline = "".join(nodeline)
+    return nodeline, interline
 
 
 def fix_long_right_edges(edges):
@@ -112,17 +155,16 @@ def ascii(state, type, char, text, coldata, verbose):
     #     o | |            o | |
     fix_nodeline_tail = len(text) <= 2
 
-    # nodeline is the line containing the node character (typically o)
-    nodeline = ["|", " "] * idx
-    nodeline.extend([char, " "])
+    # The lines are built as strings, rather than character by character.
 
-    nodeline.extend(
+    # nodeline is the line containing the node character (typically o)
+    nodeline = "| " * idx + char + " " + \
         get_nodeline_edges_tail(idx, state[1], ncols, coldiff,
-                                state[0], fix_nodeline_tail))
+                                state[0], fix_nodeline_tail)
 
     # shift_interline is the line containing the non-vertical
     # edges between this entry and the next
-    shift_interline = ["|", " "] * idx
+    shift_interline = "| " * idx
     if coldiff == -1:
         n_spaces = 1
         edge_ch = "/"
@@ -132,30 +174,28 @@ def ascii(state, type, char, text, coldata, verbose):
     else:
         n_spaces = 3
         edge_ch = "\\"
-    shift_interline.extend(n_spaces * [" "])
-    shift_interline.extend([edge_ch, " "] * (ncols - idx - 1))
+    shift_interline += " " * n_spaces + (edge_ch + " ") * (ncols - idx - 1)
 
     # draw edges from the current node to its parents
-    draw_edges(edges, nodeline, shift_interline)
+    nodeline, shift_interline = draw_edges(edges, nodeline, shift_interline)
 
     # lines is the list of all graph lines to print
-    lines = [nodeline]
-    lines.append(shift_interline)
+    lines = [nodeline, shift_interline]
 
     # make sure that there are as many graph lines as there are
     # log strings
-    if any("/" in s for s in lines) or verbose:
+    if verbose or "/" in lines[0] or "/" in lines[1]:
         while len(text) < len(lines):
             text.append('')
     if len(lines) < len(text):
-        extra_interline = ["|", " "] * (ncols + coldiff)
+        extra_interline = "| " * (ncols + coldiff)
         while len(lines) < len(text):
             lines.append(extra_interline)
 
     indentation_level = max(ncols, ncols + coldiff)
     result = []
     for (line, logstr) in zip(lines, text):
-        graph = "%-*s" % (2 * indentation_level, "".join(line))
+        graph = "%-*s" % (2 * indentation_level, line)
         if not graph.isspace():
             result.append([graph, logstr])
 
@@ -165,52 +205,253 @@ def ascii(state, type, char, text, coldata, verbose):
     return result
 
 
-def generate(verbose, num_header_lines, first_visible_line, last_visible_line, inline_graph, nodesData):
+class Layout(object):
     """
-    Generate an array of the graph, and text describing the node of the graph.
+    The graph part of every row, kept from one render to the next.
+
+    Rows are laid out from the newest node down, so a new undo state at the
+    top only needs its own rows laid out: the rows below it are reused as
+    long as the columns they were laid out from didn't change, i.e. as long
+    as the new states didn't branch off above the cached ones.
+
+    Rows are only laid out as far down as they are asked for. The columns
+    after the last one are kept as a checkpoint to carry on from when more
+    are needed.
     """
-    seen, state = [], [0, 0]
-    result = []
-    current = nodesData.current()
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.root = None
+        self.verbose = None
+        # (node, column, graph lines), newest node first
+        self.rows = []
+        # The columns and state of ascii() after the last row.
+        self.checkpoint = (Columns(), [0, 0])
+
+    def update(self, nodes, verbose, parents=None, count=None):
+        """
+        Lay out 'nodes' (sorted oldest first) and return the rows: at least
+        'count' of them, or all of them if 'count' is None.
+
+        'parents' maps the nodes drawn under another row than their parent's
+        to that row (see Folds). Such layouts change with every fold, so they
+        are laid out afresh.
+        """
+        if count is None or count > len(nodes):
+            count = len(nodes)
+        if parents is not None:
+            self.clear()
+            seen, state = Columns(), [0, 0]
+            return [self._layout(seen, state, node, parents.get(node, node.parent))
+                    for node in nodes[:-count - 1:-1]]
+
+        if nodes[0] is not self.root or verbose != self.verbose:
+            self.clear()
+            self.root = nodes[0]
+            self.verbose = verbose
+
+        if self.rows:
+            new = []
+            for node in reversed(nodes):
+                if node.n <= self.rows[0][0].n:
+                    break
+                new.append(node)
+
+            seen, state = Columns(), [0, 0]
+            rows = [self._layout(seen, state, node, node.parent) for node in new]
+            # The cached top row was laid out from empty columns, which is
+            # equivalent to columns holding just itself.
+            top = self.rows[0][0]
+            if top not in seen:
+                seen.append(top)
+            if seen.nodes == [top] and state == [0, 0]:
+                self.rows = rows + self.rows
+            else:
+                self.rows = []
+                self.checkpoint = (Columns(), [0, 0])
 
-    nodes, nmap = nodesData.make_nodes()
+        seen, state = self.checkpoint
+        for i in range(len(nodes) - len(self.rows) - 1, len(nodes) - count - 1, -1):
+            self.rows.append(self._layout(seen, state, nodes[i], nodes[i].parent))
+        return self.rows
 
-    for node in nodes:
-        node.children = [n for n in nodes if n.parent == node]
+    def _layout(self, seen, state, node, parent):
+        if parent:
+            parents = [parent]
+        else:
+            parents = []
+        coldata = asciiedges(seen, node, parents)
+        # The node character and text are filled in by generate(): neither
+        # changes the layout.
+        graph = [line[0] for line in ascii(state, 'C', 'o', [''], coldata, self.verbose)]
+        return (node, coldata[0], graph)
+
+class Chain(object):
+    """
+    A run of states that each have a single child, shown as a single row
+    standing for its newest state.
+    """
+    __slots__ = ('members', 'n', 'parent', 'time', 'saved')
+
+    def __init__(self, members):
+        # Newest first.
+        self.members = members
+        self.n = members[0].n
+        self.parent = members[-1].parent
+        self.time = members[0].time
+        self.saved = False
+
+    def summary(self):
+        oldest = self.members[-1]
+        spent = duration(int(self.time or 0) - int(oldest.time or 0))
+        return '[%s..%s] %d changes, %s' % (oldest.n, self.n, len(self.members), spent)
+
+class Folds(object):
+    """
+    Which runs of states the collapsed view folds into a Chain row.
 
-    def walk_nodes(nodes):
+    States with a single child are folded together, except for the current
+    state and the saved ones. Runs shorter than 'min_run' states, and those
+    that were expanded, are left alone. A run is known by its oldest state.
+    """
+    def __init__(self):
+        self.min_run = 0
+        self.expanded = set()
+        # The run of each state in a run, and the Chain of each folded one,
+        # as of the last collapse().
+        self.runs = {}
+        self.chains = {}
+
+    def collapse(self, nodes, current):
+        """
+        Return the rows to show for 'nodes' (sorted oldest first), and the
+        parents to draw them under (see Layout.update).
+        """
+        def foldable(node):
+            return (node.parent is not None and len(node.children) == 1 and
+                    not node.saved and node.n != current)
+
+        self.runs = {}
+        self.chains = {}
+        parents = {}
         for node in nodes:
-            if node.parent:
-                yield (node, [node.parent])
-            else:
-                yield (node, [])
+            if not foldable(node) or foldable(node.parent):
+                continue
+            run = [node]
+            while foldable(run[-1].children[0]):
+                run.append(run[-1].children[0])
+            for member in run:
+                self.runs[member.n] = node.n
+            if len(run) < max(self.min_run, 2) or node.n in self.expanded:
+                continue
+            run.reverse()
+            chain = Chain(run)
+            for member in run:
+                self.chains[member.n] = chain
+            parents[run[0].children[0]] = chain
+
+        rows = []
+        for node in nodes:
+            chain = self.chains.get(node.n)
+            if chain is None:
+                rows.append(node)
+            elif chain.n == node.n:
+                rows.append(chain)
+        return rows, parents
+
+    def shown(self, n):
+        """ Return the number of the row state 'n' is shown on. """
+        chain = self.chains.get(n)
+        if chain is None:
+            return n
+        return chain.n
+
+    def expand(self, n):
+        """ Expand the run of state 'n'. Return True if it was folded. """
+        if n not in self.chains:
+            return False
+        self.expanded.add(self.runs[n])
+        return True
+
+    def fold(self, n):
+        """ Fold the run of state 'n' back. Return True if it was expanded. """
+        run = self.runs.get(n)
+        if run not in self.expanded:
+            return False
+        self.expanded.discard(run)
+        return True
+
+layout = Layout()
+
+def generate(verbose, num_header_lines, first_visible_line, last_visible_line, inline_graph, nodesData, row_nodes=None, folds=None, window=None):
+    """
+    Generate an array of the graph, and text describing the node of the graph.
+
+    If 'row_nodes' is given, the node shown on each row (or None for rows
+    that only hold edges) is appended to it. If 'folds' is given, the runs
+    it folds are shown as a single row, whose node is a Chain.
 
-    dag = sorted(nodes, key=lambda n: int(n.n), reverse=True)
-    dag = walk_nodes(dag)
+    If 'window' is given, it is a (count, n) pair: only the top 'count' rows
+    are generated, or more to reach down to the row of the current node and
+    to that of node 'n' (unless it is None).
+    """
+    result = []
+    current = nodesData.current()
+
+    nodes, nmap = nodesData.make_nodes()
 
     line_number = num_header_lines
-    for idx, part in list(enumerate(dag)):
-        node, parents = part
-        if node.time:
-            age_label = age(int(node.time))
-        else:
-            age_label = 'Original'
-        line = '[%s] %s' % (node.n, age_label)
-        if node.n == current:
-            char = '@'
-        elif node.saved:
-            char = 'w'
+    with profiler.phase('layout'):
+        parents = None
+        if folds and folds.min_run:
+            nodes, parents = folds.collapse(nodes, current)
+        count = None
+        if window is not None:
+            count, n = window
+            if n is None or n > current:
+                n = current
+            count = max(count, _rows_until(nodes, n))
+        rows = layout.update(nodes, verbose, parents, count)
+        if count is not None:
+            rows = rows[:count]
+    for node, column, graph in rows:
+        if isinstance(node, Chain):
+            char = ':'
+            line = node.summary()
         else:
-            char = 'o'
-        show_inine_diff = inline_graph and line_number >= first_visible_line and line_number <= last_visible_line
-        preview_diff = nodesData.preview_diff(node.parent, node, False, show_inine_diff)
-        line = '[%s] %-10s %s' % (node.n, age_label, preview_diff)
-        new_lines = ascii(state, 'C', char, [line], asciiedges(seen, node, parents), verbose)
+            if node.time:
+                age_label = age(int(node.time))
+            else:
+                age_label = 'Original'
+            if node.n == current:
+                char = '@'
+            elif node.saved:
+                char = 'w'
+            else:
+                char = 'o'
+            show_inine_diff = inline_graph and line_number >= first_visible_line and line_number <= last_visible_line
+            preview_diff = nodesData.preview_diff(node.parent, node, False, show_inine_diff)
+            line = '[%s] %-10s %s' % (node.n, age_label, preview_diff)
+        nodeline = graph[0][:2 * column] + char + graph[0][2 * column + 1:]
+        new_lines = [[nodeline, line]] + [[g, ''] for g in graph[1:]]
         line_number += len(new_lines)
         result.extend(new_lines)
-    util._undo_to(current)
+        if row_nodes is not None:
+            row_nodes.append(node)
+            row_nodes.extend([None] * (len(new_lines) - 1))
+    nodesData.restore_current()
     return result
 
+def _rows_until(nodes, n):
+    """ Return how many of the rows of 'nodes' reach down to node 'n'. """
+    count = 0
+    for node in reversed(nodes):
+        count += 1
+        if node.n <= n:
+            break
+    return count
+
 # Mercurial age function -----------------------------------------------------------
 agescales = [("yr", 3600 * 24 * 365),
              ("mon", 3600 * 24 * 30),
@@ -246,3 +487,12 @@ def age(ts):
             return '%s ago' % fmt(t, n)
 
     return "<1 min ago"
+
+
+def duration(seconds):
+    '''turn a number of seconds into a duration string.'''
+    for t, s in agescales:
+        n = seconds // s
+        if n >= 2:
+            return "%d %ss" % (n, t)
+    return "%d sec" % max(seconds, 0)
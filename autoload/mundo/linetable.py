@@ -0,0 +1,93 @@
+import array
+import difflib
+import sys
+
+# Line ids are stored as C ints.
+TYPECODE = 'i'
+
+class LineTable(object):
+    """
+    A table of the distinct lines seen in the target buffer.
+
+    Versions are kept as arrays of line ids rather than lists of strings, so
+    states that share most of their lines share most of their memory: it
+    grows with the number of distinct lines, not with states times length.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ids = {}
+        self.strings = []
+        # Roughly the bytes held by the strings.
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, lines):
+        """ Return the array of the ids of 'lines', adding unknown ones. """
+        ids = self.ids
+        strings = self.strings
+        result = array.array(TYPECODE)
+        for line in lines:
+            i = ids.get(line)
+            if i is None:
+                i = ids[line] = len(strings)
+                strings.append(line)
+                self.bytes += sys.getsizeof(line)
+            result.append(i)
+        return result
+
+    def lines(self, ids):
+        """ Return the list of the lines whose ids are 'ids'. """
+        strings = self.strings
+        return [strings[i] for i in ids]
+
+    def unified_diff(self, a, b, fromfile='', tofile='', fromfiledate='',
+                     tofiledate='', n=3, lineterm='\n', groups=None):
+        """
+        Like difflib.unified_diff, but matching the line id arrays 'a' and
+        'b': comparing ints is cheaper than comparing strings, and the output
+        is the same since equal lines have equal ids.
+
+        If they were already matched elsewhere, 'groups' are their grouped
+        opcodes (with 'n' lines of context).
+        """
+        strings = self.strings
+        started = False
+        if groups is None:
+            groups = difflib.SequenceMatcher(None, a, b).get_grouped_opcodes(n)
+        for group in groups:
+            if not started:
+                started = True
+                fromdate = '\t%s' % fromfiledate if fromfiledate else ''
+                todate = '\t%s' % tofiledate if tofiledate else ''
+                yield '--- %s%s%s' % (fromfile, fromdate, lineterm)
+                yield '+++ %s%s%s' % (tofile, todate, lineterm)
+
+            first, last = group[0], group[-1]
+            yield '@@ -%s +%s @@%s' % (_format_range(first[1], last[2]),
+                                       _format_range(first[3], last[4]),
+                                       lineterm)
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    for i in a[i1:i2]:
+                        yield ' ' + strings[i]
+                    continue
+                if tag in ('replace', 'delete'):
+                    for i in a[i1:i2]:
+                        yield '-' + strings[i]
+                if tag in ('replace', 'insert'):
+                    for i in b[j1:j2]:
+                        yield '+' + strings[i]
+
+def _format_range(start, stop):
+    """ Format a range of lines the way unified diff hunk headers do. """
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '%s' % beginning
+    if not length:
+        beginning -= 1
+    return '%s,%s' % (beginning, length)
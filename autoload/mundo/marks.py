@@ -0,0 +1,85 @@
+import bisect
+
+class Marks(object):
+    """
+    Where the marker of each node is in the rendered graph, and which node is
+    on each row, so moving around the graph never has to read it back from
+    the buffer.
+
+    Rows and columns count from 0. Nodes are kept in the order of their rows,
+    along with the positions (in that order) of the saved ones.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.rows = []
+        self.nodes = []
+        self.columns = []
+        self.saved = []
+        # node number -> position
+        self.positions = {}
+
+    def add(self, row, column, n, saved):
+        """ Add node 'n', marked at ('row', 'column'), below the others. """
+        self.positions[n] = len(self.rows)
+        if saved:
+            self.saved.append(len(self.rows))
+        self.rows.append(row)
+        self.columns.append(column)
+        self.nodes.append(n)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, n):
+        return n in self.positions
+
+    def __getitem__(self, n):
+        """ Return the (row, column) of the marker of node 'n'. """
+        i = self.positions[n]
+        return self.rows[i], self.columns[i]
+
+    def at(self, row):
+        """ Return the number of the node on 'row', or None. """
+        i = bisect.bisect_left(self.rows, row)
+        if i < len(self.rows) and self.rows[i] == row:
+            return self.nodes[i]
+        return None
+
+    def position(self, n):
+        return self.positions[n]
+
+    def mark(self, i):
+        """ Return the (row, column) of the node at position 'i'. """
+        return self.rows[i], self.columns[i]
+
+    def move(self, row, count):
+        """
+        Return the position 'count' nodes below 'row' (above it if 'count' is
+        negative), stopping at the first and last nodes. From a row between
+        two nodes, the nearest node in that direction is one away.
+        """
+        if count > 0:
+            i = bisect.bisect_right(self.rows, row) - 1 + count
+        else:
+            i = bisect.bisect_left(self.rows, row) + count
+        return max(0, min(i, len(self.rows) - 1))
+
+    def move_saved(self, row, count):
+        """
+        Return the position of the 'count'th saved node below 'row' (above it
+        if 'count' is negative). Without that many, stop at the last (or
+        first) node.
+        """
+        if count > 0:
+            first = bisect.bisect_right(self.rows, row)
+            k = bisect.bisect_left(self.saved, first) + count - 1
+            if k < len(self.saved):
+                return self.saved[k]
+            return len(self.rows) - 1
+        last = bisect.bisect_left(self.rows, row) - 1
+        k = bisect.bisect_right(self.saved, last) + count
+        if k >= 0:
+            return self.saved[k]
+        return 0
@@ -1,134 +1,685 @@
-import diff
+import collections
 import difflib
-import itertools
+import os
+import sys
 import time
-import util
+from mundo import cache, diff, diffqueue, diskcache, linetable, search, util
+from mundo.profiler import profiler
 
 # Python undo tree data structures and functions ----------------------------------
 class Node(object):
-    def __init__(self, n, parent, time, curhead, saved):
+    # Histories can hold tens of thousands of states: skip the per-instance
+    # __dict__.
+    __slots__ = ('n', 'parent', 'children', 'saved', 'time')
+
+    def __init__(self, n, parent, time, saved):
         self.n = int(n)
         self.parent = parent
         self.children = []
-        self.curhead = curhead
         self.saved = saved
         self.time = time
 
     def __repr__(self):
-        return "[n=%s,parent=%s,time=%s,curhead=%s,saved=%s]" % \
-            (self.n,self.parent,self.time,self.curhead,self.saved)
+        return "[n=%s,parent=%s,time=%s,saved=%s]" % \
+            (self.n,self.parent,self.time,self.saved)
+
+class Versions(object):
+    """
+    Rebuild historical versions of the target buffer without undoing it.
+
+    Only a few versions are kept as full 'anchor' snapshots. Every other
+    captured version is stored as the line delta from (or to) a neighbouring
+    version, so any version linked to an anchor can be rebuilt by patching.
+
+    Versions are sequences of lines; Nodes stores them as arrays of line ids
+    (see linetable.LineTable).
+    """
+    def __init__(self, anchor_distance=32):
+        self.anchor_distance = anchor_distance
+        self.clear()
+
+    def clear(self):
+        self.anchors = {}
+        # child n -> (parent n, opcodes)
+        self.deltas = {}
+        # n -> list of neighbouring n's that share a delta with n
+        self.links = {}
+        # n -> approximate number of deltas to the nearest anchor
+        self.depth = {}
+        # parent n -> list of child n's that were captured before the parent
+        self.orphans = {}
+        # Roughly the bytes held by the anchors and the deltas.
+        self.bytes = 0
+
+    def __contains__(self, n):
+        return n in self.depth
+
+    def add(self, n, parent, lines):
+        """ Record the lines of version 'n', whose parent version is 'parent'. """
+        if n in self.depth:
+            return
+        self.anchors[n] = lines
+        self.bytes += sys.getsizeof(lines)
+        self.depth[n] = 0
+        self.links[n] = []
+        if parent is not None:
+            if parent in self.depth:
+                self._link(parent, n, self.get(parent), lines, n)
+            else:
+                self.orphans.setdefault(parent, []).append(n)
+        for child in self.orphans.pop(n, []):
+            self._link(n, child, lines, self.get(child), child)
+
+    def get(self, n):
+        """ Return the lines of version 'n', or None if it can't be rebuilt. """
+        if n in self.anchors:
+            return self.anchors[n]
+        if n not in self.depth:
+            return None
+
+        # Find the closest anchor, then patch our way back to 'n'.
+        came_from = {n: None}
+        queue = collections.deque([n])
+        while queue:
+            m = queue.popleft()
+            if m in self.anchors:
+                break
+            for o in self.links[m]:
+                if o not in came_from:
+                    came_from[o] = m
+                    queue.append(o)
+
+        lines = self.anchors[m][:]
+        while came_from[m] is not None:
+            lines = self._patch(lines, m, came_from[m])
+            m = came_from[m]
+        return lines
+
+    def _link(self, parent, child, parent_lines, child_lines, loose):
+        """
+        Store the delta between 'parent' and 'child', and drop the anchor of
+        'loose' (one of the two) if it is close enough to another anchor.
+        """
+        delta = _line_delta(parent_lines, child_lines)
+        self.deltas[child] = (parent, delta)
+        self.bytes += sys.getsizeof(delta) + sum(
+            sys.getsizeof(op) + sys.getsizeof(op[4]) + sys.getsizeof(op[5])
+            for op in delta)
+        self.links[parent].append(child)
+        self.links[child].append(parent)
+
+        other = parent if loose == child else child
+        if loose not in self.anchors:
+            return
+        # Versions rebuilt from the anchor of 'loose' would then be rebuilt
+        # through 'other': all of them must stay close enough to an anchor.
+        depths = self._depths_from(loose, other, self.depth[other] + 1)
+        if depths is not None:
+            self.bytes -= sys.getsizeof(self.anchors.pop(loose))
+            self.depth.update(depths)
+
+    def _depths_from(self, n, other, depth):
+        """
+        Return the depths of 'n' and the versions rebuilt through it (those
+        linked to it, away from 'other', up to the next anchors) if 'n' was
+        at 'depth', or None if one of them would be too deep.
+        """
+        depths = {n: depth}
+        queue = collections.deque([n])
+        while queue:
+            m = queue.popleft()
+            if depths[m] >= self.anchor_distance:
+                return None
+            for o in self.links[m]:
+                if o != other and o not in depths and o not in self.anchors:
+                    depths[o] = depths[m] + 1
+                    queue.append(o)
+        return depths
+
+    def _patch(self, lines, src, dest):
+        """ Turn the lines of version 'src' into those of its neighbour 'dest'. """
+        delta = self.deltas.get(dest)
+        if delta and delta[0] == src:
+            for i1, i2, j1, j2, old, new in reversed(delta[1]):
+                lines[i1:i2] = new
+        else:
+            for i1, i2, j1, j2, old, new in reversed(self.deltas[src][1]):
+                lines[j1:j2] = old
+        return lines
+
+def path_between(origin, dest):
+    """
+    Return the nodes to go through, in order, to get from node 'origin' to
+    node 'dest': up to their lowest common ancestor, then down to 'dest'.
+    'origin' itself isn't included.
+    """
+    up = []
+    seen = set()
+    node = origin
+    while node is not None:
+        up.append(node)
+        seen.add(node.n)
+        node = node.parent
+
+    down = []
+    node = dest
+    while node.n not in seen:
+        down.append(node)
+        node = node.parent
+    # 'node' is now the common ancestor.
+    up = up[1:up.index(node) + 1]
+    down.reverse()
+    return up + down
+
+def _line_delta(before, after):
+    """
+    Return the opcodes that turn 'before' into 'after' as a list of
+    (i1, i2, j1, j2, old_lines, new_lines) tuples.
+    """
+    # Most undo states touch a handful of lines: only run the matcher over
+    # the part between the common prefix and suffix.
+    lo = 0
+    hi = min(len(before), len(after))
+    while lo < hi and before[lo] == after[lo]:
+        lo += 1
+    tail = 0
+    while tail < hi - lo and before[-tail - 1] == after[-tail - 1]:
+        tail += 1
+    a = before[lo:len(before) - tail]
+    b = after[lo:len(after) - tail]
+
+    delta = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if tag != 'equal':
+            delta.append((lo + i1, lo + i2, lo + j1, lo + j2, a[i1:i2], b[j1:j2]))
+    return delta
+
+# Shown in place of an inline diff that is still being computed.
+INLINE_PENDING = '...'
+
+# Shown in place of a preview the worker is still computing.
+DIFF_PENDING = '(computing the diff...)'
+
+# Shown instead of a diff the worker took too long to compute.
+DIFF_CANCELLED = '(the diff took longer than %d ms and was cancelled)'
+
+# Default budgets of the version and diff caches, in bytes.
+LINES_CACHE_MAX_BYTES = 32 * 1024 * 1024
+DIFFS_CACHE_MAX_BYTES = 8 * 1024 * 1024
 
 class Nodes(object):
     def __init__(self):
+        self.versions = Versions()
+        self.table = linetable.LineTable()
+        self.lines = cache.LRUCache(LINES_CACHE_MAX_BYTES)
+        self.diffs = cache.LRUCache(DIFFS_CACHE_MAX_BYTES)
+        self.changes = search.ChangeIndex()
+        # When set, inline diffs are summarized by this diffqueue.DiffQueue
+        # instead of inline.
+        self.diff_queue = None
+        # The key of the preview diff the worker is computing, if any.
+        self.waiting = None
+        # The diskcache.DiskCache of the target file: None until it is
+        # opened, False if it can't be used.
+        self.disk = None
+        self.cache_id = 0
+        # How many times the stored versions outgrew their budget.
+        self.version_drops = 0
+        self.restore_to = None
         self._clear_cache()
 
     def _clear_cache(self):
+        # Put back the buffer the cached versions were read from first.
+        self.restore_current()
         self.nodes_made = None
         self.target_f = None
         self.changedtick = None
-        self.lines = {}
+        self.lines.clear()
+        self.versions.clear()
+        self.table.clear()
+        self.changes.clear()
         self.clear_oneline_diffs()
+        self._close_disk_cache()
 
     def clear_oneline_diffs(self):
-        self.diffs = {}
-        self.diff_has_oneline = {}
+        self.diffs.clear()
+        # Summaries still being computed belong to the old cache.
+        self.cache_id += 1
+
+    def _open_disk_cache(self):
+        """
+        Open the on-disk cache of the target file, if g:mundo_cache_dir is
+        set and the file has an undo file to outlive this session.
+        """
+        nodes = self.nodes_made[0]
+        cache_dir = util.settings().cache_dir
+        if not cache_dir or len(nodes) < 2:
+            return
+        self.disk = False
+        path, undofile = util._undofile(util.settings().target_n)
+        if undofile:
+            oldest = nodes[1]
+            self.disk = diskcache.open_cache(os.path.expanduser(cache_dir),
+                    path, undofile, self.seq_last, [oldest.n, oldest.time]) or False
+
+    def _close_disk_cache(self):
+        if self.disk:
+            self.disk.close()
+        self.disk = None
+
+    def _cached_diff(self, key, disk_key):
+        """ Return the diff cached under 'key' in memory or on disk. """
+        cached = self.diffs.get(key)
+        if cached is None and self.disk:
+            cached = self.disk.get(disk_key)
+            if cached is not None:
+                self.diffs[key] = cached
+        return cached
+
+    def _cache_diff(self, key, disk_key, seq, result):
+        self.diffs[key] = result
+        if self.disk:
+            self.disk.put(disk_key, seq, result)
+
+    def _disk_key(self, key, before, after, *extra):
+        """
+        Return the on-disk key of the diff cached under 'key': the times of
+        the states compared tell them apart from states of other histories.
+        """
+        times = [node and node.time or 0 for node in (before, after)]
+        return ' '.join(str(part) for part in [key] + times + list(extra))
+
+    def _unified_diff(self, key, a, b, *header):
+        """
+        Return the unified diff of the line id arrays 'a' and 'b' (cached
+        under 'key'), matched by the diff queue's worker if it takes them.
+        Return None while the worker is matching them: the diff is then
+        'waiting' (see preview_ready()).
+        """
+        groups = None
+        if self.diff_queue:
+            queue_key = (self.cache_id, key)
+            groups = self.diff_queue.opcodes(queue_key, a, b, diff.CONTEXT)
+            if groups == diffqueue.PENDING:
+                self.waiting = queue_key
+                return None
+        return list(self.table.unified_diff(a, b, *header, n=diff.CONTEXT,
+                                            groups=groups))
+
+    def preview_ready(self):
+        """
+        Return True once the worker is done with the diff that was waiting,
+        so that the preview showing DIFF_PENDING can be rendered again.
+        """
+        if self.waiting is None or not self.diff_queue.answered(self.waiting):
+            return False
+        self.waiting = None
+        return True
+
+    def collect_inline_diffs(self):
+        """
+        Cache the inline diffs summarized in the background since the last
+        call, and return how many there were.
+        """
+        if not self.diff_queue:
+            return 0
+        count = 0
+        for (cache_id, key, disk_key, seq), summary in self.diff_queue.results().items():
+            if cache_id == self.cache_id:
+                self._cache_diff(key, disk_key, seq, summary)
+                count += 1
+        return count
+
+    def set_cache_budget(self, lines_max_bytes, diffs_max_bytes):
+        """
+        Set the byte budgets of the version and the diff caches.
+
+        The budget of the version cache also bounds the stored versions and
+        the table of lines: once the three of them outgrow it, they are all
+        dropped, and versions are read from the buffer again as they are
+        needed. This is only done here, at the start of an operation, as
+        the line ids handed out during one are only valid until then.
+        """
+        self.lines.resize(lines_max_bytes)
+        self.diffs.resize(diffs_max_bytes)
+        if self.lines.bytes + self.versions.bytes + self.table.bytes > lines_max_bytes:
+            self.lines.clear()
+            self.versions.clear()
+            self.table.clear()
+            self.version_drops += 1
+
+    def cache_stats(self):
+        """ Return the counters of the version and the diff caches. """
+        lines = self.lines.stats()
+        lines['drops'] = self.version_drops
+        return {'lines': lines, 'diffs': self.diffs.stats()}
+
+    def memory_stats(self):
+        """
+        Measure the bytes held by the tree and each of the caches. Objects
+        shared between them (lines in the table, versions both stored and
+        cached) are counted once, with the first of them listed here.
+        """
+        seen = set()
+        tree = 0
+        if self.nodes_made:
+            nodes, nmap = self.nodes_made
+            tree = cache.measure(nodes, seen) + cache.measure(nmap, seen)
+            for node in nodes:
+                tree += cache.measure(node.children, seen)
+        table = cache.measure(self.table.strings, seen) + \
+            cache.measure(self.table.ids, seen)
+        versions = cache.measure([self.versions.anchors, self.versions.deltas,
+                                  self.versions.links, self.versions.depth,
+                                  self.versions.orphans], seen)
+        lines = cache.measure(self.lines.entries, seen)
+        diffs = cache.measure(self.diffs.entries, seen)
+        changes = cache.measure([self.changes.postings, self.changes.lines,
+                                 self.changes.indexed, self.changes.matches], seen)
+        return {
+            'tree': tree,
+            'line_table': table,
+            'versions': versions,
+            'lines_cache': lines,
+            'diffs_cache': diffs,
+            'search_index': changes,
+            'total': tree + table + versions + lines + diffs + changes,
+        }
 
     def _check_version_location(self):
-        util._goto_window_for_buffer(util.vim().eval('g:mundo_target_n'))
-        target_f = util.vim().eval('g:mundo_target_f')
+        target_f = util.settings().target_f
         if target_f != self.target_f:
             self._clear_cache()
 
-    def _make_nodes(self,alts, nodes, parent=None):
-        p = parent
+    def _make_root(self):
+        root = Node(0, None, False, False)
+        self.nodes_made = ([root], {0: root})
+        self.seq_last = 0
+        self.save_last = 0
+
+    def _ingest(self, entries, seq_last, save_last):
+        """
+        Add the undotree() entries that aren't in the tree yet, up to state
+        'seq_last', and mark the state written last ('save_last') as saved.
+
+        Vim keeps the newest branch first among alternatives, so states made
+        since the last walk are at the ends of the lists of entries. Lists
+        are walked from their end, diving into 'alt' branches as they come
+        (with an explicit stack, so deep nesting can't hit the recursion
+        limit), and the walk stops once every new state and the last write
+        are found: after an edit it only reads a few entries.
+
+        Returns False if some known entries disappeared from the tree (as
+        happens when 'undolevels' drops old states), in which case the tree
+        must be rebuilt from scratch.
+        """
+        nodes, nmap = self.nodes_made
+        if len(entries) and entries[0]:
+            first = nmap.get(int(entries[0]['seq']))
+            if first is not None and first.parent is not nmap[0]:
+                # The oldest states were freed.
+                return False
 
-        for alt in alts:
-            if alt:
-                curhead = 'curhead' in alt
+        wanted = seq_last - self.seq_last
+        written = save_last == self.save_last
+        found = []
+        seen = 1
+        done = wanted <= 0 and written
+        stack = [(entries, 0, len(entries) - 1)]
+        while stack and not done:
+            alts, parent, i = stack.pop()
+            while i >= 0:
+                alt = alts[i]
+                i -= 1
+                if not alt:
+                    continue
+                n = int(alt['seq'])
+                p = parent
+                if i >= 0 and alts[i]:
+                    p = int(alts[i]['seq'])
                 saved = 'save' in alt
-                node = Node(n=alt['seq'], parent=p, time=alt['time'], curhead=curhead, saved=saved)
-                nodes.append(node)
-                if alt.get('alt'):
-                    self._make_nodes(alt['alt'], nodes, p)
-                p = node
+                if n > self.seq_last:
+                    found.append((n, p, int(alt['time']), saved))
+                    wanted -= 1
+                elif n in nmap:
+                    nmap[n].saved = saved
+                else:
+                    return False
+                if saved and int(alt['save']) == save_last:
+                    written = True
+                seen += 1
+                done = wanted <= 0 and written
+                if done:
+                    break
+                if 'alt' in alt:
+                    stack.append((alts, parent, i))
+                    stack.append((alt['alt'], p, len(alt['alt']) - 1))
+                    break
+
+        # New states always have higher numbers than the known ones, and
+        # than their parents: adding them in order keeps 'nodes' sorted.
+        added = []
+        for n, p, t, saved in sorted(found):
+            parent = nmap.get(p)
+            if parent is None:
+                return False
+            node = Node(n=n, parent=parent, time=t, saved=saved)
+            parent.children.append(node)
+            nmap[n] = node
+            added.append(node)
+        nodes.extend(added)
+        for parent in set(node.parent for node in added):
+            parent.children.sort(key=lambda child: child.n)
+        # Only a walk through every entry can tell whether some are gone.
+        return done or seen == len(nmap)
 
     def is_outdated(self):
-        util._goto_window_for_buffer(util.vim().eval('g:mundo_target_n'))
-        current_changedtick = util.vim().eval('b:changedtick')
+        current_changedtick = util._changedtick(util.settings().target_n)
         return self.changedtick != current_changedtick
 
     def make_nodes(self):
         # If the current changedtick is unchanged, we don't need to do
-        # anything:
-        if not self.is_outdated():
+        # anything. The same goes for when we moved the target buffer around
+        # ourselves to fetch a version: the tree itself didn't change.
+        if self.restore_to is not None or not self.is_outdated():
             return self.nodes_made
 
         self._check_version_location()
-        target_f = util.vim().eval('g:mundo_target_f')
-        ut = util.vim().eval('undotree()')
-        entries = ut['entries']
-        seq_last = ut['seq_last']
-        current_changedtick = util.vim().eval('b:changedtick')
-
-        root = Node(0, None, False, 0, 0)
-        nodes = []
-        # TODO only compute new values (not all values)
-        self._make_nodes(entries, nodes, root)
-        nodes.append(root)
-        nmap = dict((node.n, node) for node in nodes)
+        target_n = util.settings().target_n
+        target_f = util.settings().target_f
+        with profiler.phase('ingest'):
+            ut = util._undotree(target_n)
+        seq_last = int(ut['seq_last'])
+        save_last = int(ut['save_last'])
+        current_changedtick = util._changedtick(target_n)
+
+        if self.nodes_made is None or seq_last < self.seq_last:
+            if self.nodes_made is not None:
+                # The whole history was replaced (e.g. by reloading the
+                # buffer): the versions we know of are gone with it.
+                self.lines.clear()
+                self.versions.clear()
+                self.table.clear()
+                self.changes.clear()
+                self.clear_oneline_diffs()
+                self._close_disk_cache()
+            self._make_root()
+
+        # Plain undo/redo only moves seq_cur around: the entries only need
+        # walking when there are new states or new writes.
+        if seq_last != self.seq_last or save_last != self.save_last:
+            with profiler.phase('ingest'):
+                if not self._ingest(ut['entries'], seq_last, save_last):
+                    self._make_root()
+                    self._ingest(ut['entries'], seq_last, save_last)
 
         # cache values for later use
         self.target_f = target_f
         self.seq_last = seq_last
-        self.nodes_made = (nodes, nmap)
+        self.save_last = save_last
+        self.seq_cur = int(ut['seq_cur'])
         self.changedtick = current_changedtick
+        if self.disk is None:
+            self._open_disk_cache()
 
         return self.nodes_made
 
     def current(self):
         """ Return the number of the current change. """
+        if self.restore_to is not None:
+            return self.restore_to
         self._check_version_location()
-        nodes, nmap = self.make_nodes()
-        _curhead_l = list(itertools.dropwhile(lambda n: not n.curhead, nodes))
-        if _curhead_l:
-            current = _curhead_l[0].parent.n
-        else:
-            current = int(util.vim().eval('changenr()'))
-        return current
+        self.make_nodes()
+        return self.seq_cur
 
     def _fmt_time(self,t):
         return time.strftime('%Y-%m-%d %I:%M:%S %p', time.localtime(float(t)))
 
     def _get_lines(self,node):
+        return self.table.lines(self._get_ids(node))
+
+    def _get_ids(self,node):
+        """ Return the line ids of the version of 'node'. """
         n = 0
         if node:
             n = node.n
-        if n not in self.lines:
-            util._undo_to(n)
-            self.lines[n] = util.vim().current.buffer[:]
-        return self.lines[n]
+        lines = self.lines.get(n)
+        if lines is None:
+            lines = self.versions.get(n)
+            if lines is None:
+                lines = self.table.intern(self._read_version(n))
+                parent = None
+                if node and node.parent:
+                    parent = node.parent.n
+                self.versions.add(n, parent, lines)
+            self.lines[n] = lines
+        return lines
+
+    def _peek_lines(self, node):
+        """
+        Return the lines of the version of 'node' like _get_lines(), but
+        without keeping them: a version that isn't known yet is read from the
+        target buffer and left out of the caches.
+        """
+        ids = self.lines.get(node.n)
+        if ids is None:
+            ids = self.versions.get(node.n)
+        if ids is not None:
+            return self.table.lines(ids)
+        return self._read_version(node.n)
+
+    def _read_version(self, n):
+        """
+        Return the lines of the target buffer at change 'n', moving it there
+        if needed (see restore_current()).
+        """
+        current = self.current()
+        target_n = util.settings().target_n
+        if n != current or self.restore_to is not None:
+            if self.restore_to is None:
+                self.restore_to = current
+                self.restore_b = target_n
+            util._undo_to(n, target_n)
+        return util._buffer(target_n)[:]
+
+    def restore_current(self):
+        """
+        Undo the target buffer back to the current change, if fetching a
+        version moved it elsewhere.
+        """
+        if self.restore_to is None:
+            return
+        # The target may have changed since: undo the buffer that was moved.
+        util._undo_to(self.restore_to, self.restore_b)
+        self.restore_to = None
+        # Jumping around the tree bumps b:changedtick, but leaves the tree
+        # itself untouched.
+        self.changedtick = util._changedtick(self.restore_b)
+
+    def search(self, pattern):
+        """
+        Return the set of changes that added or removed a line matching
+        'pattern', the last search pattern of Vim.
+
+        States are indexed the first time they are searched, so later
+        searches only check the lines no earlier search has seen.
+        """
+        nodes, nmap = self.make_nodes()
+        with profiler.phase('diff'):
+            for node in nodes:
+                if node.n in self.changes:
+                    continue
+                if node.parent:
+                    delta = self.versions.deltas.get(node.n)
+                    if not delta or delta[0] != node.parent.n:
+                        delta = (node.parent.n, _line_delta(
+                            self._get_ids(node.parent), self._get_ids(node)))
+                else:
+                    delta = (None, _line_delta([], self._get_ids(None)))
+                self.changes.add(node.n, [
+                    (i1, i2, j1, j2, self.table.lines(old), self.table.lines(new))
+                    for i1, i2, j1, j2, old, new in delta[1]])
+        self.restore_current()
+        return self.changes.search(pattern, util._matching)
 
     def change_preview_diff(self,before,after):
         self._check_version_location()
         key = "%s-%s-cpd"%(before.n,after.n)
-        if key in self.diffs:
-            return self.diffs[key]
+        disk_key = self._disk_key(key, before, after)
+        cached = self._cached_diff(key, disk_key)
+        if cached is not None:
+            return cached
+
+        with profiler.phase('diff'):
+            before_lines = self._get_ids(before)
+            after_lines = self._get_ids(after)
+
+            before_name = str(before.n or 'Original')
+            before_time = before.time and self._fmt_time(before.time) or ''
+            after_name = str(after.n or 'Original')
+            after_time = after.time and self._fmt_time(after.time) or ''
 
-        util._goto_window_for_buffer(util.vim().eval('g:mundo_target_n'))
-        before_lines = self._get_lines(before)
-        after_lines = self._get_lines(after)
+            self.restore_current()
 
-        before_name = str(before.n or 'Original')
-        before_time = before.time and self._fmt_time(before.time) or ''
-        after_name = str(after.n or 'Original')
-        after_time = after.time and self._fmt_time(after.time) or ''
+            try:
+                result = self._unified_diff(key, before_lines, after_lines,
+                                            before_name, after_name,
+                                            before_time, after_time)
+            except diffqueue.Timeout:
+                return [DIFF_CANCELLED % self.diff_queue.timeout]
+            if result is None:
+                return [DIFF_PENDING]
+        self._cache_diff(key, disk_key, max(before.n, after.n), result)
+        return result
 
-        util._undo_to(self.current())
+    def patch_series(self, origin, dest):
+        """
+        Generate the lines of the unified diffs of each step from node
+        'origin' to node 'dest' (see path_between()), one step at a time.
 
-        self.diffs[key] = list(difflib.unified_diff(before_lines, after_lines,
-                                         before_name, after_name,
-                                         before_time, after_time))
-        return self.diffs[key]
+        Versions that aren't cached yet are read without being added to the
+        caches: only those of the step being diffed are held, so a whole
+        history can be streamed out.
+        """
+        self._check_version_location()
+        previous = origin
+        before = None
+        try:
+            for node in path_between(origin, dest):
+                with profiler.phase('diff'):
+                    if before is None:
+                        before = self._peek_lines(previous)
+                    after = self._peek_lines(node)
+                    header = [str(n.n or 'Original') for n in (previous, node)]
+                    header += [n.time and self._fmt_time(n.time) or ''
+                               for n in (previous, node)]
+                for line in difflib.unified_diff(before, after, *header,
+                                                 n=diff.CONTEXT):
+                    yield line
+                previous = node
+                before = after
+        finally:
+            self.restore_current()
 
     def preview_diff(self, before, after, unified=True, inline=False):
         """
@@ -145,52 +696,72 @@ class Nodes(object):
         self._check_version_location()
         bn = 0
         an = 0
-        if not after.n:    # we're at the original file
-            pass
-        elif not before.n: # we're at a pseudo-root state
-            an = after.n
-        else:
-            bn = before.n
-            an = after.n
-        key = "%s-%s-pd-%s"%(bn,an,unified)
-        needs_oneline = inline and key not in self.diff_has_oneline
-        if key in self.diffs and not needs_oneline:
-            return self.diffs[key]
-
-        if not after.n:    # we're at the original file
-            before_lines = []
-            after_lines = self._get_lines(None)
-
-            before_name = 'n/a'
-            before_time = ''
-            after_name = 'Original'
-            after_time = ''
-        elif not before.n: # we're at a pseudo-root state
-            before_lines = self._get_lines(None)
-            after_lines = self._get_lines(after)
-
-            before_name = 'Original'
-            before_time = ''
-            after_name = str(after.n)
-            after_time = self._fmt_time(after.time)
-        else:
-            before_lines = self._get_lines(before)
-            after_lines = self._get_lines(after)
-
-            before_name = str(before.n)
-            before_time = self._fmt_time(before.time)
-            after_name = str(after.n)
-            after_time = self._fmt_time(after.time)
-
-        if unified:
-            self.diffs[key] = list(difflib.unified_diff(before_lines, after_lines,
-                                             before_name, after_name,
-                                             before_time, after_time))
-        elif inline:
-            maxwidth = int(util.vim().eval("winwidth(0)"))
-            self.diffs[key] = diff.one_line_diff_str('\n'.join(before_lines),'\n'.join(after_lines),maxwidth)
-            self.diff_has_oneline[key] = True
-        else:
-            self.diffs[key] = ""
+        with profiler.phase('diff'):
+            if not after.n:    # we're at the original file
+                pass
+            elif not before.n: # we're at a pseudo-root state
+                an = after.n
+            else:
+                bn = before.n
+                an = after.n
+            key = "%s-%s-pd-%s"%(bn,an,unified)
+            if unified:
+                disk_key = self._disk_key(key, bn and before, an and after)
+            else:
+                # Summaries are cut to the width of the window.
+                disk_key = self._disk_key(key, bn and before, an and after,
+                                          util.settings().target_width)
+            cached = self._cached_diff(key, disk_key)
+            if cached is not None:
+                return cached
+            if not unified and not inline:
+                # Only one line summaries are cached under this key, and we
+                # weren't asked to compute one.
+                return ""
+
+            if not after.n:    # we're at the original file
+                before_lines = []
+                after_lines = self._get_ids(None)
+
+                before_name = 'n/a'
+                before_time = ''
+                after_name = 'Original'
+                after_time = ''
+            elif not before.n: # we're at a pseudo-root state
+                before_lines = self._get_ids(None)
+                after_lines = self._get_ids(after)
+
+                before_name = 'Original'
+                before_time = ''
+                after_name = str(after.n)
+                after_time = self._fmt_time(after.time)
+            else:
+                before_lines = self._get_ids(before)
+                after_lines = self._get_ids(after)
+
+                before_name = str(before.n)
+                before_time = self._fmt_time(before.time)
+                after_name = str(after.n)
+                after_time = self._fmt_time(after.time)
+
+            if unified:
+                try:
+                    result = self._unified_diff(key, before_lines, after_lines,
+                                                before_name, after_name,
+                                                before_time, after_time)
+                except diffqueue.Timeout:
+                    return [DIFF_CANCELLED % self.diff_queue.timeout]
+                if result is None:
+                    return [DIFF_PENDING]
+            else:
+                maxwidth = util.settings().target_width
+                before_text = '\n'.join(self.table.lines(before_lines))
+                after_text = '\n'.join(self.table.lines(after_lines))
+                if self.diff_queue:
+                    self.diff_queue.submit((self.cache_id, key, disk_key, max(bn, an)),
+                            before_text, after_text, maxwidth)
+                    return INLINE_PENDING
+                result = diff.one_line_diff_str(before_text,after_text,maxwidth)
 
-        return self.diffs[key]
+        self._cache_diff(key, disk_key, max(bn, an), result)
+        return result
@@ -0,0 +1,156 @@
+import collections
+import functools
+import time
+
+clock = getattr(time, 'perf_counter', time.time)
+
+# The phases of an operation, in the order the report lists them:
+PHASES = [
+    ('ingest', 'reading undotree() into the tree'),
+    ('layout', 'laying out the graph'),
+    ('diff', 'computing diffs and inline summaries'),
+    ('undo', 'jumping around the target buffer for versions'),
+    ('bridge', 'other calls into Vim'),
+    ('write', 'writing the Mundo buffers'),
+]
+
+# Operations that took at least this long are kept in the slow history...
+SLOW_SECONDS = 0.05
+# ...which holds this many of the most recent ones.
+SLOW_HISTORY = 20
+
+class _Null(object):
+    """ What phase() returns while the profiler is off. """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null = _Null()
+
+class _Phase(object):
+    __slots__ = ('profiler', 'name', 'start', 'inner')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        self.inner = 0
+        self.profiler.stack.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = clock() - self.start
+        stack = self.profiler.stack
+        stack.pop()
+        # Phases only count the time not spent in the phases they contain.
+        self.profiler._add(self.name, elapsed - self.inner)
+        if stack:
+            stack[-1].inner += elapsed
+        return False
+
+class Profiler(object):
+    """
+    Times the operations Mundo performs (rendering the graph, a preview...)
+    broken down into PHASES.
+
+    The profiler is off until enable() is called, and costs next to nothing
+    while it is off.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.stack = []
+        self.current = None
+        self.clear()
+
+    def clear(self):
+        # operation -> [calls, seconds]
+        self.operations = {}
+        # phase -> seconds
+        self.phases = collections.defaultdict(float)
+        self.slow = collections.deque(maxlen=SLOW_HISTORY)
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        self.stack = []
+        self.current = None
+
+    def phase(self, name, nested=True):
+        """
+        Return a context manager timing the 'name' phase of the current
+        operation. Unless 'nested', it doesn't time anything inside another
+        phase: the time then stays with the enclosing one.
+        """
+        if self.current is None or (not nested and self.stack):
+            return _null
+        return _Phase(self, name)
+
+    def operation(self, name):
+        """
+        Decorate a function as the 'name' operation. Operations started from
+        within another one are counted as part of it.
+        """
+        def decorate(fn):
+            @functools.wraps(fn)
+            def timed(*args, **kwargs):
+                if not self.enabled or self.current is not None:
+                    return fn(*args, **kwargs)
+                self.current = {}
+                start = clock()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self._record(name, clock() - start, self.current)
+                    self.current = None
+            return timed
+        return decorate
+
+    def _add(self, name, seconds):
+        self.phases[name] += seconds
+        self.current[name] = self.current.get(name, 0) + seconds
+
+    def _record(self, name, seconds, phases):
+        totals = self.operations.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+        if seconds >= SLOW_SECONDS:
+            self.slow.append((time.time(), name, seconds, phases))
+
+    def report(self):
+        """ Return the lines of a report of everything timed so far. """
+        lines = ['Mundo profile (%s)' % ('on' if self.enabled else 'off'), '']
+
+        lines.append('%-20s %8s %10s %10s' % ('Operation', 'Calls', 'Total ms', 'Mean ms'))
+        for name, (calls, seconds) in sorted(self.operations.items(),
+                                             key=lambda item: -item[1][1]):
+            lines.append('%-20s %8d %10.1f %10.1f' % (name, calls, seconds * 1000,
+                                                     seconds * 1000 / calls))
+        if not self.operations:
+            lines.append('(nothing yet: turn the profiler on with :MundoProfile on)')
+
+        total = sum(seconds for calls, seconds in self.operations.values())
+        lines += ['', '%-20s %10s %6s' % ('Phase', 'Total ms', 'Share')]
+        names = [name for name, description in PHASES] + ['other']
+        descriptions = dict(PHASES, other='the rest of Mundo')
+        other = total - sum(self.phases.values())
+        for name in names:
+            seconds = other if name == 'other' else self.phases.get(name, 0)
+            share = total and 100 * seconds / total
+            lines.append('%-20s %10.1f %5.1f%%  %s' % (name, seconds * 1000, share,
+                                                       descriptions[name]))
+
+        lines += ['', 'Slow operations (%d ms or more), most recent first:'
+                  % (SLOW_SECONDS * 1000)]
+        for when, name, seconds, phases in reversed(self.slow):
+            breakdown = ', '.join('%s %.1f' % (phase, phases[phase] * 1000)
+                                  for phase, description in PHASES if phase in phases)
+            lines.append('%s %-20s %8.1f ms  %s' % (time.strftime('%H:%M:%S', time.localtime(when)),
+                                                   name, seconds * 1000, breakdown))
+        if not self.slow:
+            lines.append('(none)')
+        return lines
+
+profiler = Profiler()
@@ -0,0 +1,61 @@
+class ChangeIndex(object):
+    """
+    An inverted index of the lines each undo state added and removed.
+
+    Lines are indexed the way a unified diff shows them ('+' or '-' followed
+    by the line) so that search patterns see what the preview pane shows.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # diff line -> set of the states that added or removed it
+        self.postings = {}
+        # the distinct diff lines, in the order they were indexed
+        self.lines = []
+        self.indexed = set()
+        self.pattern = None
+        self.checked = 0
+        self.matches = set()
+
+    def __contains__(self, n):
+        return n in self.indexed
+
+    def add(self, n, delta):
+        """
+        Index the changes of state 'n', given as the delta from its parent
+        (see node._line_delta).
+        """
+        if n in self.indexed:
+            return
+        for i1, i2, j1, j2, old, new in delta:
+            for line in old:
+                self._post('-' + line, n)
+            for line in new:
+                self._post('+' + line, n)
+        self.indexed.add(n)
+
+    def search(self, pattern, match):
+        """
+        Return the set of states with a change matching 'pattern'.
+
+        'match' is called with the distinct lines that haven't been checked
+        against 'pattern' yet, and returns the indexes of the matching ones.
+        """
+        if pattern != self.pattern:
+            self.pattern = pattern
+            self.checked = 0
+            self.matches = set()
+        lines = self.lines[self.checked:]
+        if lines:
+            for i in match(lines):
+                self.matches.update(self.postings[lines[int(i)]])
+        self.checked = len(self.lines)
+        return self.matches
+
+    def _post(self, line, n):
+        states = self.postings.get(line)
+        if states is None:
+            states = self.postings[line] = set()
+            self.lines.append(line)
+        states.add(n)
@@ -1,15 +1,108 @@
 # import vim
+import itertools
+
+from mundo.profiler import profiler
 
 normal = lambda s: vim().command('normal %s' % s)
 normal_silent = lambda s: vim().command('silent! normal %s' % s)
 
+# Calls made into Vim, and undo jumps made to read versions (see
+# mundo#Stats()).
+counters = {'eval': 0, 'command': 0, 'undo_jumps': 0}
+
+class Bridge(object):
+    """
+    The vim module, with the calls into Vim counted and timed as the
+    'bridge' phase of the profiler.
+    """
+    def __init__(self, module):
+        self.module = module
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+    def eval(self, expr):
+        counters['eval'] += 1
+        with profiler.phase('bridge', nested=False):
+            return self.module.eval(expr)
+
+    def command(self, command):
+        counters['command'] += 1
+        with profiler.phase('bridge', nested=False):
+            return self.module.command(command)
+
+_bridge = None
+
 def vim():
     """ call Vim.
     
     This is wrapped so that it can easily be mocked.
     """
-    import vim
-    return vim
+    global _bridge
+    if _bridge is None:
+        import vim
+        _bridge = Bridge(vim)
+    return _bridge
+
+# Everything Mundo reads from Vim once per operation: (name, expression, type)
+SETTINGS = [
+    ('target_n', 'g:mundo_target_n', int),
+    ('target_f', 'g:mundo_target_f', str),
+    ('target_loaded', 'bufloaded(g:mundo_target_n)', int),
+    ('target_winnr', 'bufwinnr(g:mundo_target_n)', int),
+    ('target_width', 'winwidth(bufwinnr(g:mundo_target_n))', int),
+    ('first_visible_line', "line('w0')", int),
+    ('last_visible_line', "line('w$')", int),
+    ('mundo_first_visible_line', 'g:mundo_first_visible_line', int),
+    ('mundo_last_visible_line', 'g:mundo_last_visible_line', int),
+    ('verbose_graph', 'g:mundo_verbose_graph', int),
+    ('map_move_older', 'g:mundo_map_move_older', str),
+    ('map_move_newer', 'g:mundo_map_move_newer', str),
+    ('help', 'g:mundo_help', int),
+    ('inline_undo', 'g:mundo_inline_undo', int),
+    ('mirror_graph', 'g:mundo_mirror_graph', int),
+    ('auto_preview', 'g:mundo_auto_preview', int),
+    ('playback_delay', 'g:mundo_playback_delay', int),
+    ('return_on_revert', 'g:mundo_return_on_revert', int),
+    ('close_on_revert', 'g:mundo_close_on_revert', int),
+    ('cache_max_bytes', 'g:mundo_cache_max_bytes', int),
+    ('diff_cache_max_bytes', 'g:mundo_diff_cache_max_bytes', int),
+    ('cache_dir', 'g:mundo_cache_dir', str),
+    ('collapse', 'g:mundo_collapse', int),
+    ('graph_page', 'g:mundo_graph_page', int),
+    # The last line shown in the graph's window: the height of the screen
+    # before it opens, and -1 if Vim can't tell.
+    ('graph_bottom', "bufwinnr('__Mundo__') == -1 ? &lines : "
+                     "exists('*getwininfo') ? "
+                     "getwininfo(win_getid(bufwinnr('__Mundo__')))[0].botline : -1", int),
+    ('win_execute', "exists('*win_execute')", int),
+]
+
+SETTINGS_EXPR = '{%s}' % ', '.join(["'%s': %s" % (name, expr)
+                                     for name, expr, kind in SETTINGS])
+
+class Settings(object):
+    """ The Mundo options and the state of its windows, as read from Vim. """
+    def __init__(self, values):
+        for name, expr, kind in SETTINGS:
+            setattr(self, name, kind(values[name]))
+
+_settings = None
+
+def snapshot():
+    """
+    Read all of the Settings from Vim in a single call. Every top level
+    operation takes a snapshot, which settings() then returns.
+    """
+    global _settings
+    _settings = Settings(vim().eval(SETTINGS_EXPR))
+    return _settings
+
+def settings():
+    """ Return the Settings of the last snapshot(). """
+    if _settings is None:
+        return snapshot()
+    return _settings
 
 def _goto_window_for_buffer(b):
     w = int(vim().eval('bufwinnr(%d)' % int(b)))
@@ -19,16 +112,207 @@ def _goto_window_for_buffer_name(bn):
     b = vim().eval('bufnr("%s")' % bn)
     return _goto_window_for_buffer(b)
 
+# Buffer access functions: none of these switch windows
+def _buffer(b):
+    """ Return the buffer object of buffer number 'b'. """
+    return vim().buffers[int(b)]
+
+def _changedtick(b):
+    """ Return b:changedtick of buffer 'b'. """
+    return int(vim().eval('getbufvar(%d, "changedtick")' % int(b)))
+
+def _undofile(b):
+    """
+    Return the full path of buffer 'b' and the name of its undo file, which
+    is empty if the buffer doesn't use 'undofile'.
+    """
+    path = "fnamemodify(bufname(%d), ':p')" % int(b)
+    uses_undofile = ("exists('*undofile') && bufname(%d) != '' && "
+                     "getbufvar(%d, '&undofile')" % (int(b), int(b)))
+    return vim().eval("[%s, %s ? undofile(%s) : '']" % (path, uses_undofile, path))
+
+def _window_for_buffer_name(bn):
+    """ Return the window of buffer 'bn', or None if it isn't shown. """
+    w = int(vim().eval('bufwinnr(bufnr("%s"))' % bn))
+    if w < 1:
+        return None
+    return vim().windows[w - 1]
+
+def _cursor_line(bn):
+    """
+    Return the line under the cursor in the window of buffer 'bn', or None
+    if it isn't shown.
+    """
+    window = _window_for_buffer_name(bn)
+    if window is None:
+        return None
+    return window.buffer[window.cursor[0] - 1]
+
+def _cursor_row(bn):
+    """
+    Return the row (from 0) of the cursor in the window of buffer 'bn', or
+    None if it isn't shown.
+    """
+    window = _window_for_buffer_name(bn)
+    if window is None:
+        return None
+    return window.cursor[0] - 1
+
+def _in_buffer(b, command):
+    """
+    Run the Ex 'command' in the window of buffer 'b'.
+
+    With win_execute() the current window never changes, so no WinEnter or
+    BufEnter autocommands fire. Otherwise we go to the window and back.
+    """
+    b = int(b)
+    if settings().win_execute:
+        vim().command("call win_execute(win_getid(bufwinnr(%d)), '%s')" %
+                      (b, command.replace("'", "''")))
+    else:
+        w = int(vim().eval('winnr()'))
+        _goto_window_for_buffer(b)
+        vim().command(command)
+        vim().command('%dwincmd w' % w)
+
+def _undotree(b=None):
+    """
+    Return undotree() of the current buffer, or of buffer 'b'.
+
+    Where Vim supports it the result is bound rather than converted, so its
+    entries are only read as they are walked.
+    """
+    expr = 'undotree()'
+    if b is not None:
+        _in_buffer(b, 'let g:mundo_undotree = undotree()')
+        expr = 'g:mundo_undotree'
+    if hasattr(vim(), 'bindeval'):
+        tree = vim().bindeval(expr)
+    else:
+        tree = vim().eval(expr)
+    if b is not None:
+        vim().command('unlet g:mundo_undotree')
+    return tree
+
+def _matching(lines):
+    """
+    Return the indexes of 'lines' that match the last search pattern, all
+    checked in a single call into Vim.
+    """
+    vim().vars['mundo_search_lines'] = lines
+    try:
+        return vim().eval("filter(range(len(g:mundo_search_lines)), "
+                          "'g:mundo_search_lines[v:val] =~ @/')")
+    finally:
+        vim().command('unlet g:mundo_search_lines')
+
+# The diff worker job (see diffqueue.WorkerQueue)
+def _worker_start(command):
+    """ Start the worker, a job running 'command'. Return True if it runs. """
+    vim().vars['mundo_worker_command'] = command
+    try:
+        return int(vim().eval('s:MundoWorkerStart(g:mundo_worker_command)')) == 1
+    finally:
+        vim().command('unlet g:mundo_worker_command')
+
+def _worker_send(line):
+    """ Send 'line' to the worker. Return False if it isn't running. """
+    vim().vars['mundo_worker_request'] = line
+    try:
+        return int(vim().eval('s:MundoWorkerSend(g:mundo_worker_request)')) == 1
+    finally:
+        vim().command('unlet g:mundo_worker_request')
+
+def _worker_read(timeout):
+    """ Read a line from the worker, waiting up to 'timeout' milliseconds. """
+    return vim().eval('s:MundoWorkerRead(%d)' % timeout)
+
+def _worker_stop():
+    vim().command('call s:MundoWorkerStop()')
+
 # Rendering utility functions
+def _update_buffer(buffer, old, new):
+    """
+    Replace the contents of 'buffer' with the lines 'new', only writing the
+    lines that differ from 'old' (the lines last written to it, or None).
+    """
+    with profiler.phase('write'):
+        _write_changes(buffer, old, new)
+
+def _write_changes(buffer, old, new):
+    if old is None or len(buffer) != len(old):
+        buffer[:] = new
+        return
+
+    if len(old) == len(new):
+        # Typically just the '@' marker moved: rewrite each changed run.
+        i = 0
+        while i < len(new):
+            if old[i] == new[i]:
+                i += 1
+                continue
+            j = i + 1
+            while j < len(new) and old[j] != new[j]:
+                j += 1
+            buffer[i:j] = new[i:j]
+            i = j
+        return
+
+    lo = 0
+    hi = min(len(old), len(new))
+    while lo < hi and old[lo] == new[lo]:
+        lo += 1
+    tail = 0
+    while tail < hi - lo and old[-tail - 1] == new[-tail - 1]:
+        tail += 1
+    buffer[lo:len(old) - tail] = new[lo:len(new) - tail]
+
+def _stream_text(b, lines, chunk=1000):
+    """
+    Replace the lines of the 'nomodifiable' buffer 'b' with those of the
+    iterable 'lines', written 'chunk' lines at a time so they never all have
+    to be held at once. Return how many lines were written.
+    """
+    b = int(b)
+    buffer = _buffer(b)
+    lines = iter(lines)
+    count = 0
+    vim().command('call setbufvar(%d, "&modifiable", 1)' % b)
+    try:
+        batch = list(itertools.islice(lines, chunk))
+        with profiler.phase('write'):
+            buffer[:] = batch
+        while batch:
+            count += len(batch)
+            batch = list(itertools.islice(lines, chunk))
+            if batch:
+                with profiler.phase('write'):
+                    buffer.append(batch)
+    finally:
+        vim().command('call setbufvar(%d, "&modifiable", 0)' % b)
+    return count
+
 def _output_preview_text(lines):
     _goto_window_for_buffer_name('__Mundo_Preview__')
-    vim().command('setlocal modifiable')
-    vim().current.buffer[:] = [line.rstrip() for line in lines]
-    vim().command('setlocal nomodifiable')
+    _output_text(lines)
+
+def _output_text(lines):
+    """ Replace the lines of the current, 'nomodifiable', buffer. """
+    with profiler.phase('write'):
+        vim().command('setlocal modifiable')
+        vim().current.buffer[:] = [line.rstrip() for line in lines]
+        vim().command('setlocal nomodifiable')
 
-def _undo_to(n):
+def _undo_to(n, b=None):
+    """ Undo to change 'n' in the current buffer, or in buffer 'b'. """
     n = int(n)
     if n == 0:
-        vim().command('silent earlier %s' % (int(vim().eval('&undolevels')) + 1))
+        command = "execute 'silent earlier ' . (&undolevels + 1)"
     else:
-        vim().command('silent undo %d' % int(n))
+        command = 'silent undo %d' % n
+    counters['undo_jumps'] += 1
+    with profiler.phase('undo'):
+        if b is None:
+            vim().command(command)
+        else:
+            _in_buffer(b, command)
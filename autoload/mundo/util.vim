@@ -93,6 +93,30 @@ call mundo#util#set_default(
             \ 'g:mundo_return_on_revert', 1,
             \ 'g:gundo_return_on_revert')
 
+call mundo#util#set_default(
+            \ 'g:mundo_refresh_delay', 100)
+
+call mundo#util#set_default(
+            \ 'g:mundo_cache_max_bytes', 33554432)
+
+call mundo#util#set_default(
+            \ 'g:mundo_diff_cache_max_bytes', 8388608)
+
+call mundo#util#set_default(
+            \ 'g:mundo_cache_dir', '')
+
+call mundo#util#set_default(
+            \ 'g:mundo_worker_python', '')
+
+call mundo#util#set_default(
+            \ 'g:mundo_worker_timeout', 2000)
+
+call mundo#util#set_default(
+            \ 'g:mundo_collapse', 0)
+
+call mundo#util#set_default(
+            \ 'g:mundo_graph_page', 0)
+
 function! mundo#util#init() abort
 
 endfunction
@@ -0,0 +1,50 @@
+"""
+The diff worker: a separate process Vim starts as a job, so that the heavy
+diffs run outside of Vim's own interpreter.
+
+It reads one request per line on stdin, and writes one response per line on
+stdout, both as JSON:
+
+    [id, "summary", before, after, width]  ->  [id, one line summary]
+    [id, "opcodes", a, b, context]         ->  [id, grouped opcodes]
+    anything else                          ->  [id, null, error message]
+
+'a' and 'b' are line id arrays (see linetable.LineTable): they are matched
+here, and the unified diff is written back in Vim from the grouped opcodes.
+"""
+import difflib
+import json
+import os
+import sys
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mundo import diff
+
+def handle(request):
+    """ Return the response to 'request'. """
+    rid, kind, args = request[0], request[1], request[2:]
+    if kind == 'summary':
+        return [rid, diff.one_line_diff_str(*args)]
+    if kind == 'opcodes':
+        a, b, context = args
+        groups = difflib.SequenceMatcher(None, a, b).get_grouped_opcodes(context)
+        return [rid, [[list(op) for op in group] for group in groups]]
+    return [rid, None, 'unknown request: %s' % kind]
+
+def main(stdin=sys.stdin, stdout=sys.stdout):
+    for line in iter(stdin.readline, ''):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+        try:
+            response = handle(request)
+        except Exception as e:
+            response = [request[0], None, str(e)]
+        stdout.write(json.dumps(response) + '\n')
+        stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import nose
+from nose.tools import *
+from mock import patch
+from mundo.diffqueue import DiffQueue, PENDING
+from mundo.node import DIFF_PENDING, Node, Nodes, Versions, path_between
+import mundo.util as util
+
+def test_versions_rebuild():
+  versions = Versions(anchor_distance=2)
+  versions.add(0, None, ['one'])
+  versions.add(1, 0, ['one', 'two'])
+  versions.add(2, 1, ['one', 'two', 'three'])
+  versions.add(3, 1, ['zero', 'one', 'two'])
+  eq_(sorted(versions.anchors.keys()), [0, 2, 3])
+  eq_(versions.get(1), ['one', 'two'])
+  eq_(versions.get(3), ['zero', 'one', 'two'])
+  eq_(versions.get(4), None)
+
+def test_versions_orphans():
+  versions = Versions()
+  versions.add(2, 1, ['a', 'b', 'c'])
+  versions.add(1, 0, ['a', 'c'])
+  eq_(sorted(versions.anchors.keys()), [1])
+  eq_(versions.get(2), ['a', 'b', 'c'])
+
+def _fake_vim(mock_vim, tree, changedtick):
+  values = {'getbufvar(1, "changedtick")': changedtick, 'g:mundo_target_f': 'f',
+            'g:mundo_cache_dir': ''}
+  values[util.SETTINGS_EXPR] = dict(
+      (name, values.get(expr, '1')) for name, expr, kind in util.SETTINGS)
+  mock_vim.return_value.eval.side_effect = lambda e: values.get(e, '1')
+  mock_vim.return_value.bindeval.return_value = tree
+  util.snapshot()
+
+@patch('mundo.util.vim')
+def test_make_nodes_incremental(mock_vim):
+  nodes = Nodes()
+  _fake_vim(mock_vim, {'seq_last': 2, 'save_last': 0, 'seq_cur': 2, 'entries': [
+    {'seq': 1, 'time': 10}, {'seq': 2, 'time': 20}]}, '1')
+  _, nmap = nodes.make_nodes()
+  first = nmap[2]
+
+  # undo to 1, make change 3, undo to 2 and make change 4.
+  _fake_vim(mock_vim, {'seq_last': 4, 'save_last': 1, 'seq_cur': 4, 'entries': [
+    {'seq': 1, 'time': 10},
+    {'seq': 2, 'time': 20, 'alt': [{'seq': 3, 'time': 30}]},
+    {'seq': 4, 'time': 40, 'save': 1}]}, '2')
+  nodes_list, nmap = nodes.make_nodes()
+  eq_([node.n for node in nodes_list], [0, 1, 2, 3, 4])
+  ok_(nmap[2] is first)
+  eq_(nmap[3].parent.n, 1)
+  eq_(nmap[4].parent.n, 2)
+  eq_([child.n for child in nmap[1].children], [2, 3])
+  ok_(nmap[4].saved)
+  eq_(nodes.current(), 4)
+
+def test_path_between():
+  root = Node(0, None, 0, False)
+  one = Node(1, root, 1, False)
+  two = Node(2, one, 2, False)
+  three = Node(3, one, 3, False)
+  four = Node(4, three, 4, False)
+  eq_([node.n for node in path_between(two, four)], [1, 3, 4])
+  eq_([node.n for node in path_between(four, two)], [3, 1, 2])
+  eq_([node.n for node in path_between(four, root)], [3, 1, 0])
+  eq_([node.n for node in path_between(root, two)], [1, 2])
+  eq_(path_between(two, two), [])
+
+@patch('mundo.util.vim')
+def test_patch_series(mock_vim):
+  _fake_vim(mock_vim, {}, '1')
+  nodes = Nodes()
+  nodes.target_f = 'f'
+  root = Node(0, None, False, False)
+  one = Node(1, root, 60, False)
+  two = Node(2, one, 120, False)
+  three = Node(3, one, 180, False)
+  for node, lines in ((root, ['a']), (one, ['a', 'b']), (two, ['a', 'b', 'c']),
+                      (three, ['a', 'd'])):
+    nodes.lines[node.n] = nodes.table.intern(lines)
+
+  series = nodes.patch_series(two, three)
+  ok_(not isinstance(series, list))
+  eq_([line.rstrip('\n') for line in series], [
+    '--- 2\t%s' % nodes._fmt_time(120), '+++ 1\t%s' % nodes._fmt_time(60),
+    '@@ -1,3 +1,2 @@', ' a', ' b', '-c',
+    '--- 1\t%s' % nodes._fmt_time(60), '+++ 3\t%s' % nodes._fmt_time(180),
+    '@@ -1,2 +1,2 @@', ' a', '-b', '+d'])
+  eq_(list(nodes.patch_series(root, one))[:2],
+      ['--- Original\n', '+++ 1\t%s\n' % nodes._fmt_time(60)])
+
+  # A version that isn't cached yet is read, but not kept.
+  four = Node(4, three, 240, False)
+  mock_vim.return_value.buffers = {1: ['a', 'd', 'e']}
+  nodes.current = lambda: 4
+  eq_(list(nodes.patch_series(three, four))[-2:], [' d', '+e'])
+  ok_(4 not in nodes.versions)
+  eq_(nodes.lines.get(4), None)
+
+@patch('mundo.util.vim')
+def test_clear_cache_restores(mock_vim):
+  _fake_vim(mock_vim, {'seq_last': 2, 'save_last': 0, 'seq_cur': 2, 'entries': [
+    {'seq': 1, 'time': 10}, {'seq': 2, 'time': 20}]}, '1')
+  mock_vim.return_value.buffers = {1: ['x']}
+  nodes = Nodes()
+  _, nmap = nodes.make_nodes()
+  nodes._get_ids(nmap[1])
+  eq_(nodes.restore_to, 2)
+
+  command = mock_vim.return_value.command
+  command.reset_mock()
+  nodes._clear_cache()
+  eq_(nodes.restore_to, None)
+  ok_([call for call in command.call_args_list if 'silent undo 2' in str(call)])
+
+def test_version_budget():
+  nodes = Nodes()
+  nodes.versions.add(0, None, nodes.table.intern(['a' * 100] * 100))
+  nodes.versions.add(1, 0, nodes.table.intern(['b'] + ['a' * 100] * 100))
+  ok_(nodes.versions.bytes > 0)
+  ok_(nodes.table.bytes > 0)
+  nodes.set_cache_budget(1024 * 1024, 1024)
+  ok_(1 in nodes.versions)
+
+  nodes.set_cache_budget(256, 1024)
+  ok_(1 not in nodes.versions)
+  eq_(nodes.versions.bytes, 0)
+  eq_(nodes.table.bytes, 0)
+  eq_(nodes.cache_stats()['lines']['drops'], 1)
+
+def test_versions_newest_first():
+  # Reading each parent after its child used to leave a single anchor, with
+  # every version rebuilt from the oldest one.
+  versions = Versions(anchor_distance=8)
+  for n in range(100, -1, -1):
+    versions.add(n, n - 1 if n else None, list(range(n)))
+  eq_(versions.get(100), list(range(100)))
+  ok_(len(versions.anchors) >= 100 // 8)
+
+  patch = versions._patch
+  patches = []
+  def counted(lines, src, dest):
+    patches.append(dest)
+    return patch(lines, src, dest)
+  versions._patch = counted
+  for n in (100, 50, 3):
+    del patches[:]
+    eq_(versions.get(n), list(range(n)))
+    ok_(len(patches) < 8)
+
+class CountingList(list):
+  def __init__(self, items):
+    list.__init__(self, items)
+    self.reads = 0
+
+  def __getitem__(self, i):
+    self.reads += 1
+    return list.__getitem__(self, i)
+
+@patch('mundo.util.vim')
+def test_make_nodes_reads_new_entries(mock_vim):
+  def tree(last):
+    # 101..149 branch off 100, and 150..last were made after undoing to it.
+    entries = CountingList([{'seq': n, 'time': n} for n in
+                            list(range(1, 101)) + list(range(150, last + 1))])
+    entries[100]['alt'] = CountingList(
+      [{'seq': n, 'time': n} for n in range(101, 150)])
+    return entries
+  nodes = Nodes()
+  _fake_vim(mock_vim, {'seq_last': 200, 'save_last': 0, 'seq_cur': 200,
+                       'entries': tree(200)}, '1')
+  nodes_list, nmap = nodes.make_nodes()
+  eq_(len(nodes_list), 201)
+  eq_(nmap[150].parent.n, 100)
+
+  entries = tree(202)
+  _fake_vim(mock_vim, {'seq_last': 202, 'save_last': 1, 'seq_cur': 202,
+                       'entries': entries}, '2')
+  entries[-1]['save'] = 1
+  nodes_list, nmap = nodes.make_nodes()
+  eq_([node.n for node in nodes_list][-3:], [200, 201, 202])
+  eq_(nmap[202].parent.n, 201)
+  ok_(nmap[202].saved)
+  ok_(entries.reads < 20)
+
+class PendingQueue(DiffQueue):
+  """ A queue whose worker is done once 'ready' is set. """
+  ready = False
+
+  def opcodes(self, key, a, b, context):
+    return None if self.ready else PENDING
+
+  def answered(self, key):
+    return self.ready
+
+@patch('mundo.util.vim')
+def test_preview_pending(mock_vim):
+  _fake_vim(mock_vim, {}, '1')
+  nodes = Nodes()
+  nodes.target_f = 'f'
+  nodes.diff_queue = PendingQueue()
+  root = Node(0, None, False, False)
+  one = Node(1, root, 60, False)
+  nodes.lines[0] = nodes.table.intern(['a'])
+  nodes.lines[1] = nodes.table.intern(['b'])
+
+  eq_(nodes.change_preview_diff(root, one), [DIFF_PENDING])
+  ok_(not nodes.preview_ready())
+  nodes.diff_queue.ready = True
+  ok_(nodes.preview_ready())
+  ok_(not nodes.preview_ready())
+  eq_(nodes.change_preview_diff(root, one)[-2:], ['-a', '+b'])
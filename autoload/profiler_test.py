@@ -0,0 +1,43 @@
+from nose.tools import *
+from mundo.profiler import Profiler
+
+def test_disabled():
+  profiler = Profiler()
+  run = profiler.operation('render')(lambda: 42)
+  eq_(run(), 42)
+  eq_(profiler.operations, {})
+
+def test_phases():
+  profiler = Profiler()
+  profiler.enable()
+
+  @profiler.operation('render')
+  def render():
+    with profiler.phase('diff'):
+      with profiler.phase('undo'):
+        pass
+      # Not timed: calls into Vim inside another phase belong to it.
+      with profiler.phase('bridge', nested=False):
+        pass
+    preview()
+
+  @profiler.operation('preview')
+  def preview():
+    with profiler.phase('write'):
+      pass
+
+  render()
+  render()
+  eq_(list(profiler.operations.keys()), ['render'])
+  eq_(profiler.operations['render'][0], 2)
+  eq_(sorted(profiler.phases.keys()), ['diff', 'undo', 'write'])
+  ok_(profiler.report()[0].startswith('Mundo profile (on)'))
+
+def test_slow_history():
+  profiler = Profiler()
+  profiler.enable()
+  for i in range(30):
+    profiler._record('render', 1, {'layout': 1})
+  eq_(len(profiler.slow), 20)
+  profiler.clear()
+  eq_(len(profiler.slow), 0)
@@ -0,0 +1,20 @@
+import nose
+from nose.tools import *
+from mundo.node import _line_delta
+from mundo.search import ChangeIndex
+
+def test_change_index():
+  index = ChangeIndex()
+  index.add(1, _line_delta([], ['one', 'two']))
+  index.add(2, _line_delta(['one', 'two'], ['one', 'three']))
+  checked = []
+  def match(lines):
+    checked.extend(lines)
+    return [i for i, line in enumerate(lines) if 'two' in line]
+  eq_(index.search('two', match), set([1, 2]))
+  eq_(checked, ['+one', '+two', '-two', '+three'])
+
+  # only new lines are checked against the same pattern again.
+  index.add(3, _line_delta(['one', 'three'], ['one', 'three', 'twofold']))
+  eq_(index.search('two', match), set([1, 2, 3]))
+  eq_(checked[4:], ['+twofold'])
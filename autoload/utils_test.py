@@ -1,6 +1,8 @@
 import nose
 from nose.tools import *
 import mundo.diff as difflib
+import mundo.util as util
+from mock import Mock, patch
 
 def test_one_line_diff():
   eq_(difflib.one_line_diff('', ''), [])
@@ -21,3 +23,82 @@ def test_one_line_diff_str():
   # when the '+' is over the cuttoff, it should be appended:
   eq_(difflib.one_line_diff_str('', '1234567890abcdefghij'), '+1234567890abc+')
   eq_(difflib.one_line_diff_str('one\n\ntwo', 'one\n\ntwo\n\nthree\n\nfour'), 'wo+\\n\\nthree\\n+')
+
+def test_one_line_diff_large_hunk():
+  before = '\n'.join('line %d' % i for i in range(100))
+  pasted = '\n'.join('pasted %d' % i for i in range(5000))
+  after = before.replace('line 50', 'line 50\n' + pasted)
+  eq_(difflib.one_line_diff_str(before, after), '\\n+pasted 0\\np+')
+  eq_(difflib.one_line_diff(before, after), ['line 48\nline 49\nline 50\n', '+' + pasted + '\n+', 'line 51\nline 52\nline 53'])
+
+class RecordingBuffer(list):
+  def __init__(self, lines):
+    list.__init__(self, lines)
+    self.writes = []
+
+  def __setitem__(self, key, value):
+    self.writes.append((key.start, key.stop))
+    list.__setitem__(self, key, value)
+
+  # python 2 slices don't go through __setitem__
+  def __setslice__(self, i, j, value):
+    self.__setitem__(slice(i, j), value)
+
+def test_update_buffer():
+  old = ['a', '@ 2', 'o 1', 'o 0']
+  buffer = RecordingBuffer(old)
+  new = ['a', 'o 2', '@ 1', 'o 0']
+  util._update_buffer(buffer, old, new)
+  eq_(list(buffer), new)
+  eq_(buffer.writes, [(1, 3)])
+
+  buffer.writes = []
+  newer = ['a', '@ 3', 'o 2', '@ 1', 'o 0']
+  util._update_buffer(buffer, new, newer)
+  eq_(list(buffer), newer)
+  eq_(buffer.writes, [(1, 1)])
+
+class AppendingBuffer(RecordingBuffer):
+  def append(self, lines):
+    self.writes.append(len(lines))
+    self.extend(lines)
+
+@patch('mundo.util.vim')
+def test_stream_text(mock_vim):
+  buffer = AppendingBuffer([''])
+  mock_vim.return_value.buffers = {4: buffer}
+  lines = ('line %d' % i for i in range(5))
+  eq_(util._stream_text(4, lines, chunk=2), 5)
+  eq_(list(buffer), ['line %d' % i for i in range(5)])
+  eq_(buffer.writes[1:], [2, 1])
+  mock_vim.return_value.command.assert_called_with(
+      'call setbufvar(4, "&modifiable", 0)')
+
+@patch('mundo.util.vim')
+def test_snapshot(mock_vim):
+  values = dict((name, '3') for name, expr, kind in util.SETTINGS)
+  values['target_f'] = 'file.txt'
+  mock_vim.return_value.eval.return_value = values
+  settings = util.snapshot()
+  eq_(mock_vim.return_value.eval.call_count, 1)
+  eq_(settings.target_n, 3)
+  eq_(settings.target_f, 'file.txt')
+  ok_(util.settings() is settings)
+
+def test_bridge_counters():
+  fake = Mock()
+  bridge = util.Bridge(fake)
+  before = dict(util.counters)
+  bridge.eval('1')
+  bridge.command('echo')
+  bridge.command('echo')
+  eq_(util.counters['eval'] - before['eval'], 1)
+  eq_(util.counters['command'] - before['command'], 2)
+  ok_(bridge.buffers is fake.buffers)
+
+
+@patch('mundo.util.vim')
+def test_cursor_hidden_window(mock_vim):
+  mock_vim.return_value.eval.return_value = '-1'
+  eq_(util._cursor_row('__Mundo__'), None)
+  eq_(util._cursor_line('__Mundo__'), None)
@@ -0,0 +1,22 @@
+import json
+import nose
+from nose.tools import *
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+from mundo import worker
+
+def test_handle():
+  eq_(worker.handle([1, 'summary', 'm\nbagman', 'm\nbadger', 15]), [1, 'ba+d+g-an-+er+'])
+  eq_(worker.handle([2, 'opcodes', [1, 2, 3], [1, 4, 3], 3]),
+      [2, [[['equal', 0, 1, 0, 1], ['replace', 1, 2, 1, 2], ['equal', 2, 3, 2, 3]]]])
+  eq_(worker.handle([3, 'nonsense'])[:2], [3, None])
+
+def test_main():
+  stdin = StringIO('[1, "opcodes", [1], [1], 3]\nnot json\n[2, "summary", 1]\n')
+  stdout = StringIO()
+  worker.main(stdin, stdout)
+  lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+  eq_(lines[0], [1, []])
+  eq_(lines[1][:2], [2, None])